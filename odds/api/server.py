@@ -1,11 +1,11 @@
 import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from typing import List, Dict, Any, Optional
 
-from collections import Counter
-from odds.common.vectordb import indexer
+from odds.common.vectordb.dataset_search import find_datasets
+from odds.common.vectordb.search_filter import SearchFilter
 from odds.common.store import store
-from odds.common.embedder import embedder
 from odds.common.catalog_repo import catalog_repo
 import sqlite3
 
@@ -28,16 +28,18 @@ def parse_resource_id(id):
     return datasetId, resourceIdx
 
 
-async def search_datasets(query: str):
+async def search_datasets(query: str, catalog: Optional[str] = None, geo: Optional[str] = None, loaded_only: bool = False):
     logging.debug(f'SEARCH DATASETS: {query}')
     query_terms = query.split(',')
     query_terms = [term.strip() for term in query_terms]
     query_terms = [term for term in query_terms if term]
     logging.debug(f'QUERY TERMS: {query_terms}')
-    embeddings = await asyncio.gather(*[embedder.embed(name) for name in query_terms])
-    dataset_ids = await asyncio.gather(*[indexer.findDatasets(embedding) for embedding in embeddings])
-    dataset_ids = [x for y in dataset_ids for x in y]
-    dataset_ids = [x[0] for x in Counter(dataset_ids).most_common(10)]
+    filter = SearchFilter(
+        catalogIds=tuple(catalog.split(',')) if catalog else None,
+        geos=tuple(geo.split(',')) if geo else None,
+        loaded_only=loaded_only,
+    )
+    dataset_ids = [id for id, _ in await find_datasets(query_terms, filter=filter)]
     logging.debug(f'DATASET IDS: {dataset_ids}')
     datasets = await asyncio.gather(*[store.getDataset(id) for id in dataset_ids])
     catalogs = [catalog_repo.get_catalog(dataset.catalogId) for dataset in datasets]
@@ -134,16 +136,21 @@ async def query_db(resource_id, sql):
 
 ### A FastAPI server that serves the odds API
 # Exposes the following methods:
-# - search_datasets(query: str) -> List[Dict[str, str]]
+# - search_datasets(query: str, catalog: str, geo: str, loaded_only: bool) -> List[Dict[str, str]]
 # - fetch_dataset(id: str) -> Optional[Dict[str, str]]
 # - fetch_resource(id: str) -> Optional[Dict[str, str]]
 # - query_db(resource_id: str, query: str) -> Optional[Dict[str, Any]]
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await store.close()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/datasets")
-async def search_datasets_handler(query: str) -> List[Dict[str, str]]:
-    return await search_datasets(query)
+async def search_datasets_handler(query: str, catalog: Optional[str] = None, geo: Optional[str] = None, loaded_only: bool = False) -> List[Dict[str, str]]:
+    return await search_datasets(query, catalog, geo, loaded_only)
 
 @app.get("/dataset/{id}")
 async def fetch_dataset_handler(id: str) -> Optional[Dict[str, Any]]:
@@ -3,9 +3,10 @@ import asyncio
 from .processor import dataset_processor
 from .scanner.scanner_factory import ScannerFactory
 from ..common.catalog_repo import catalog_repo
-from ..common.datatypes import DataCatalog, Dataset
+from ..common.datatypes import DataCatalog, Dataset, Embedding
 from ..common.config import config
 from ..common.store import store
+from ..common.vectordb import indexer, lexical_index
 from ..common.filters import CatalogFilter, CatalogFilterById, \
     DatasetFilter, DatasetFilterById, DatasetFilterNew, DatasetFilterForce, DatasetFilterIncomplete
 from ..common.db import db
@@ -24,12 +25,14 @@ class ODDSBackend:
         dataset_processor.set_concurrency(config.dataset_processor_concurrency_limit or 3)
         rts.clearAll()
         scanner_ctx = ''
+        scanned = []
         for catalog_idx, catalog in enumerate(self.catalogs):
             cat_ctx = f'{catalog.id}[{catalog_idx}]'
             if await catalogFilter.include(catalog):
                 await db.storeDataCatalog(catalog, cat_ctx)
                 scanner = self.scanner_factory.create_scanner(catalog, cat_ctx)
                 if scanner:
+                    scanned.append(catalog.id)
                     dataset_idx = 0
                     async for dataset in scanner.scan():
                         rts.set(cat_ctx, f'GOT DATASET {dataset.id}')
@@ -51,6 +54,56 @@ class ODDSBackend:
             rts.clear(cat_ctx)            
         rts.clear(scanner_ctx)
         await dataset_processor.wait()
+        await indexer.flush()
+        await store.buildPackfiles(scanned)
+        await store.close()
+
+    async def reindex(self, catalogId: str = None) -> None:
+        # Rebuilds the vector and lexical indexes from the store, with no catalog access.
+        # A full rebuild goes into a fresh index which replaces the current one when done,
+        # a single catalog is reindexed in place.
+        # Datasets (packed per catalog) and embeddings are both read in bulk, only embeddings
+        # missing from the bulk read are fetched one by one. Stored datasets aren't rewritten.
+        ctx = 'reindex'
+        concurrency = config.reindex_concurrency or 32
+        target = indexer if catalogId else indexer.fresh()
+
+        datasets = dict()
+        async for dataset in store.iterDatasets(catalogId):
+            datasets[dataset.storeId()] = dataset
+        rts.set(ctx, f'LOADED {len(datasets)} DATASETS')
+
+        async def index(items: list[tuple[Dataset, Embedding]]):
+            await target.index_many(items)
+            if lexical_index is not None:
+                await lexical_index.index_many([dataset for dataset, _ in items])
+            return len(items)
+
+        count = 0
+        async for ids, vectors in store.iterEmbeddings(catalogId):
+            items = [(datasets.pop(id), vector) for id, vector in zip(ids, vectors) if id in datasets]
+            count += await index(items)
+            rts.set(ctx, f'REINDEXED {count} DATASETS')
+
+        sem = asyncio.Semaphore(concurrency)
+        async def load(dataset: Dataset):
+            async with sem:
+                return dataset, await store.getEmbedding(dataset)
+        remaining = list(datasets.values())
+        for i in range(0, len(remaining), concurrency * 8):
+            items = await asyncio.gather(*[load(dataset) for dataset in remaining[i:i + concurrency * 8]])
+            count += await index([(dataset, embedding) for dataset, embedding in items if embedding is not None])
+            rts.set(ctx, f'REINDEXED {count} DATASETS')
+
+        await target.flush()
+        if target is not indexer:
+            await indexer.promote(target)
+        rts.set(ctx, f'REINDEXED {count} DATASETS')
+        rts.clear(ctx)
+        await store.close()
+
+    def reindex_all(self, catalogId: str = None) -> None:
+        asyncio.run(self.reindex(catalogId))
 
     def scan_required(self) -> None:
         asyncio.run(self.scan(CatalogFilter(), DatasetFilterIncomplete()))
@@ -1,6 +1,6 @@
 
 from ...common.datatypes import Dataset, Embedding
-from ...common.vectordb import indexer
+from ...common.vectordb import indexer, lexical_index
 from ...common.store import store
 from ...common.config import config
 from ...common.realtime_status import realtime_status as rts
@@ -10,6 +10,8 @@ class DatasetIndexer:
 
     async def index(self, dataset: Dataset, ctx: str) -> None:
         rts.set(ctx, f'INDEXING {dataset.better_title}')
+        if lexical_index is not None:
+            await lexical_index.index(dataset)
         embedding: Embedding = dataset.getEmbedding() or await store.getEmbedding(dataset)
         if embedding is None:
             rts.set(ctx, f'NO EMBEDDING {dataset.better_title}')
@@ -1,10 +1,16 @@
 import asyncio
+import atexit
 import dataclasses
 import json
+import re
+import textwrap
 
+from ...common.batcher import MicroBatcher
 from ...common.datatypes import Dataset
 from ...common.llm import llm_runner
 from ...common.llm.llm_query import LLMQuery
+from ...common.llm.model_router import ModelRouter
+from ...common.llm.prompt_builder import count_tokens, truncate_tokens
 from ...common.store import store
 from ...common.config import config
 from ...common.realtime_status import realtime_status as rts
@@ -21,75 +27,234 @@ Return only the json object, without any additional formatting, explanation or c
 --------------
 '''
 
-MAX_STR_LEN = 50000
+BATCH_INSTRUCTIONS = '''Following are details on several datasets containing public data, each one preceded by its key. Provide a summary of each dataset in JSON format, including a concise summary and a more detailed description.
+The JSON should be a single object mapping each dataset key to its summary, and look like this:
+{
+    "<dataset key>": {
+        "summary": "<What is a good tagline for this dataset? provide a short snippet, concise and descriptive, using simple terms and avoiding jargon, summarizing the contents of this dataset. The tagline should always start with the words 'Data of', 'Information of', 'List of' or similar.>",
+        "description": "<Provide a good description of this dataset in a single paragraph, using simple terms and avoiding jargon.>"
+    },
+    ...
+}
+Make sure to include all the dataset keys in the response, and to describe each dataset based on its own details only.
+Include in the description and summary information regarding relevant time periods, geographic regions, and other relevant details.
+Return only the json object, without any additional formatting, explanation or context.
+'''
+
+SYSTEM_PROMPT = 'You are an experienced data analyst.'
+MAX_PROMPT_TOKENS = 12000
+# Datasets which encode to less than this are packed together into batched prompts
+BATCH_ITEM_MAX_TOKENS = 1500
+BATCH_MAX_TOKENS = 8000
+BATCH_MAX_DELAY = 0.5
+
+
+def encode_resource(resource: dict) -> str:
+    # A resource exactly as it appears nested in the dataset's JSON encoding
+    return textwrap.indent(json.dumps(resource, indent=2, ensure_ascii=False), '    ') + ',\n'
+
+
+def encode_dataset(dataset: Dataset, budget: int) -> tuple[str, int]:
+    # Returns the encoded dataset trimmed to the budget, along with its untrimmed size
+    data = dataclasses.asdict(dataset)
+    resources = [
+        {k: v for k, v in r.items() if k in ('title', 'fields', 'row_count')}
+        for r in data['resources']
+        if r.get('status_loaded')]
+    data = {k: v for k, v in data.items() if k in ('id', 'title', 'description', 'publisher', 'publisher_description')}
+    for k in ('title', 'description', 'publisher', 'publisher_description'):
+        if data[k]:
+            data[k] = data[k][:250]
+
+    data['resources'] = []
+    used = count_tokens(json.dumps(data, indent=2, ensure_ascii=False))
+    resource_tokens = [count_tokens(encode_resource(r)) for r in resources]
+    used += sum(resource_tokens)
+    full_tokens = used
+    for i in range(len(resources) - 1, -1, -1):
+        if used <= budget:
+            break
+        resource = resources[i]
+        resource.pop('fields')
+        if resource['title']:
+            resource['title'] = resource['title'][:128]
+        used += count_tokens(encode_resource(resource)) - resource_tokens[i]
+    data['resources'] = resources
+
+    encoded = json.dumps(data, indent=2, ensure_ascii=False)
+    if used > budget:
+        encoded = truncate_tokens(encoded, budget)
+    return encoded, full_tokens
+
+
+SUMMARY_PREFIX = re.compile(
+    r'^\W*([\w-]+\s+)?(data|information|list|lists|statistics|records|details|figures|numbers|counts|rates|register|registry|'
+    r'index|catalog|catalogue|collection|database|directory|inventory|overview|summary|report|survey|results|table|tables|map|maps|locations)'
+    r'\b(\s+[\w-]+){0,2}?\s+(of|on|about|for|regarding|from|in|by|covering)\b',
+    re.IGNORECASE
+)
+MIN_SUMMARY_LEN = 10
+MAX_SUMMARY_LEN = 200
+MIN_DESCRIPTION_LEN = 40
+MAX_DESCRIPTION_LEN = 2000
+
+
+def check_description(summary: str, description: str) -> bool:
+    return (
+        isinstance(summary, str) and isinstance(description, str) and
+        MIN_SUMMARY_LEN <= len(summary) <= MAX_SUMMARY_LEN and
+        MIN_DESCRIPTION_LEN <= len(description) <= MAX_DESCRIPTION_LEN and
+        SUMMARY_PREFIX.match(summary) is not None
+    )
+
+
+def apply_description(dataset: Dataset, result: dict, lenient: bool) -> tuple[bool, bool]:
+    # Returns whether the result passed the checks, and whether it was applied to the dataset.
+    # In lenient mode (the last model tier) any well formed result is applied.
+    summary = result.get('summary') if isinstance(result, dict) else None
+    description = result.get('description') if isinstance(result, dict) else None
+    valid = check_description(summary, description)
+    applied = valid or (lenient and isinstance(summary, str) and isinstance(description, str) and bool(summary) and bool(description))
+    if applied:
+        dataset.better_title = summary
+        dataset.better_description = description
+    return valid, applied
+
 
 class MetaDescriberQuery(LLMQuery):
 
-    def __init__(self, dataset: Dataset, ctx: str):
+    def __init__(self, dataset: Dataset, ctx: str, tier: str = 'cheap'):
         super().__init__(dataset, None)
-        self.upgraded = True
+        self.tier = tier
+        self.valid = False
         self.ctx = ctx
 
     def model(self) -> str:
-        return 'cheap' if not self.upgraded else 'expensive'
+        return self.tier
 
     def prompt(self) -> list[tuple[str, str]]:
-        data = dataclasses.asdict(self.dataset)
-        data['resources'] = [
-            {k: v for k, v in r.items() if k in ('title', 'fields', 'row_count')}
-            for r in data['resources']
-            if r.get('status_loaded')]
-        data = {k: v for k, v in data.items() if k in ('id', 'title', 'description', 'publisher', 'publisher_description', 'resources')}
-        for k in ('title', 'description', 'publisher', 'publisher_description'):
-            data[k] = data[k][:250]
-
-        for resource in data['resources'][::-1]:
-            encoded = json.dumps(data, indent=2, ensure_ascii=False)
-            if len(encoded) > MAX_STR_LEN:
-                resource.pop('fields')
-                resource['title'] = resource['title'][:128]
-            else:
-                break
-
+        budget = min(self.max_prompt_tokens(), MAX_PROMPT_TOKENS) - count_tokens(SYSTEM_PROMPT) - count_tokens(INSTRUCTIONS)
+        encoded, _ = encode_dataset(self.dataset, budget)
         return [
-            ('system', 'You are an experienced data analyst.'),
+            ('system', SYSTEM_PROMPT),
             ('user', INSTRUCTIONS + encoded)
         ]
 
     def temperature(self) -> float:
         return 0
 
-    def handle_result(self, result: dict) -> None:
-        try:
-            self.dataset.better_title = result['summary']
-            self.dataset.better_description = result['description']
-        except Exception as e:
-            print(f'{self.ctx}:ERROR', e)
-            print(f'{self.ctx}:RESULT', result)
+    def handle_result(self, result: dict) -> bool:
+        self.valid, applied = apply_description(self.dataset, result, self.tier == 'expensive')
+        if not self.valid:
+            print(f'{self.ctx}:INVALID DESCRIPTION ({self.tier})', result)
+        return applied
 
     def upgrade(self):
-        self.upgraded = True
+        self.tier = 'expensive'
 
     def max_tokens(self) -> int:
         return 512
-            
+
+
+class MetaDescriberBatchQuery(LLMQuery):
+
+    def __init__(self, items: list[tuple[Dataset, str, str]], tier: str = 'cheap'):
+        super().__init__(None, None)
+        self.items = items
+        self.tier = tier
+        self.keys = [f'D{i+1}' for i in range(len(items))]
+        self.valid = [False] * len(items)
+
+    def model(self) -> str:
+        return self.tier
+
+    def prompt(self) -> list[tuple[str, str]]:
+        encoded = '\n'.join(
+            f'--------------\n{key}:\n{payload}'
+            for key, (_, _, payload) in zip(self.keys, self.items)
+        )
+        return [
+            ('system', SYSTEM_PROMPT),
+            ('user', BATCH_INSTRUCTIONS + encoded)
+        ]
+
+    def temperature(self) -> float:
+        return 0
+
+    def handle_result(self, result: dict) -> list[bool]:
+        described = []
+        for i, (key, (dataset, ctx, _)) in enumerate(zip(self.keys, self.items)):
+            item = result.get(key) if isinstance(result, dict) else None
+            self.valid[i], applied = apply_description(dataset, item, self.tier == 'expensive')
+            if not applied:
+                print(f'{ctx}:MISSING OR INVALID IN BATCH ({self.tier})', key, item)
+            described.append(applied)
+        return described
+
+    def max_tokens(self) -> int:
+        return 512 * len(self.items)
 
 
 class MetaDescriber:
 
     sem: asyncio.Semaphore = None
     concurrency_limit: int = 3
+    batcher: MicroBatcher = None
+
+    def __init__(self) -> None:
+        self.router = ModelRouter('meta_describer')
+        atexit.register(self.router.print_stats)
 
     async def describe(self, dataset: Dataset, ctx: str) -> None:
         # rts.set(ctx, f'DESCRIBING {dataset.title} {dataset.catalogId}')
         if not self.sem:
             self.sem = asyncio.Semaphore(self.concurrency_limit)
 
+        described = False
+        batch_size = config.meta_describer_batch_size or 8
+        if batch_size > 1:
+            payload, tokens = encode_dataset(dataset, BATCH_ITEM_MAX_TOKENS)
+            if tokens <= BATCH_ITEM_MAX_TOKENS:
+                if not self.batcher:
+                    self.batcher = MicroBatcher(
+                        self.describe_batch, max_items=batch_size, max_weight=BATCH_MAX_TOKENS,
+                        max_delay=BATCH_MAX_DELAY, weight=lambda item: item[3]
+                    )
+                described = await self.batcher.submit((dataset, ctx, payload, tokens))
+        if not described:
+            await self.describe_single(dataset, ctx)
+        dataset.versions['meta_describer'] = config.feature_versions.meta_describer
+        rts.set(ctx, f'DESCRIBED {dataset.title} -> {dataset.better_title}')
+
+    async def describe_single(self, dataset: Dataset, ctx: str) -> bool:
+        async with self.sem:
+            query = MetaDescriberQuery(dataset, ctx, self.router.route())
+            conversation = [dataset.id]
+            while True:
+                described = await llm_runner.run(query, conversation)
+                self.router.record(query.tier, query.valid)
+                next_tier = self.router.next_tier(query.tier)
+                if query.valid or next_tier is None:
+                    return bool(described)
+                if config.debug:
+                    rts.set(ctx, f'ESCALATING DESCRIPTION {query.tier} -> {next_tier}')
+                query.tier = next_tier
+                conversation = conversation + [next_tier]
+
+    async def describe_batch(self, items: list[tuple[Dataset, str, str, int]]) -> list[bool]:
+        if len(items) == 1:
+            return [False]
         async with self.sem:
-            query = MetaDescriberQuery(dataset, ctx)
-            await llm_runner.run(query, [dataset.id])
-            if dataset.better_title is None:
-                query.upgrade()
-                await llm_runner.run(query)
-            dataset.versions['meta_describer'] = config.feature_versions.meta_describer
-            rts.set(ctx, f'DESCRIBED {dataset.title} -> {dataset.better_title}')
+            query = MetaDescriberBatchQuery([(dataset, ctx, payload) for dataset, ctx, payload, _ in items], self.router.route())
+            try:
+                described = await llm_runner.run(query, [','.join(dataset.id for dataset, *_ in items)])
+            except Exception as e:
+                # Each dataset falls back to its own query, as for unparseable batch output
+                print('FAILED TO DESCRIBE BATCH', len(items), repr(e))
+                return [False] * len(items)
+            for valid in query.valid:
+                self.router.record(query.tier, valid)
+            if not isinstance(described, list):
+                return [False] * len(items)
+            rts.set(items[0][1], f'DESCRIBED {sum(described)}/{len(items)} DATASETS IN BATCH ({query.tier})')
+            return described
@@ -0,0 +1,57 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class MicroBatcher:
+
+    # Gathers concurrent submit() calls into batches - flushed when max_items
+    # or max_weight is reached, or max_delay seconds after the first item arrived.
+    # The handler receives a list of items and returns a list of results in the same order.
+
+    def __init__(self, handler: Callable[[list], Awaitable[list]], max_items=16, max_weight=None, max_delay=0.05, weight=None) -> None:
+        self.handler = handler
+        self.max_items = max_items
+        self.max_weight = max_weight
+        self.max_delay = max_delay
+        self.weight = weight or (lambda item: 1)
+        self.pending = []
+        self.pending_weight = 0
+        self.timer = None
+        self.tasks = set()
+
+    async def submit(self, item) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        weight = self.weight(item)
+        if self.pending and self.max_weight is not None and self.pending_weight + weight > self.max_weight:
+            self.flush()
+        self.pending.append((item, future))
+        self.pending_weight += weight
+        if len(self.pending) >= self.max_items or (self.max_weight is not None and self.pending_weight >= self.max_weight):
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_delay, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = self.pending
+        self.pending = []
+        self.pending_weight = 0
+        if batch:
+            task = asyncio.create_task(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: list) -> None:
+        try:
+            results = list(await self.handler([item for item, _ in batch]) or [])
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(results[i] if i < len(results) else None)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
@@ -2,6 +2,7 @@ import atexit
 
 from .embedder import Embedder
 from .openai.openai_embedder import OpenAIEmbedder
+from .local.local_embedder import LocalEmbedder
 from ..select import select
 
 embedder: Embedder = select('Embedder', locals())()
@@ -1,10 +1,53 @@
+import asyncio
+
+from ..datatypes import Embedding
+from ..config import config, CACHE_DIR
+from .embedding_cache import EmbeddingCache
+
+
 class Embedder:
 
-    async def embed(self, text: str) -> None:
+    MODEL = None
+
+    def __init__(self) -> None:
+        self.cache = None
+        if not config.disable_embedding_cache:
+            self.cache = EmbeddingCache(CACHE_DIR / 'embedding_cache.sqlite', max_items=config.embedding_cache_size or 10000)
+
+    async def lookup(self, texts: list[str]) -> list[Embedding]:
+        if self.cache is None:
+            return [None] * len(texts)
+        return await self.cache.get_many(self.MODEL, texts)
+
+    async def embed(self, text: str) -> Embedding:
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: list[str]) -> list[Embedding]:
+        # Embeds only texts which are not already cached, each one once
+        embeddings = await self.lookup(texts)
+        missing = [text for text, embedding in zip(texts, embeddings) if embedding is None]
+        if missing:
+            fresh = iter(await self.embed_uncached(missing))
+            embeddings = [next(fresh) if embedding is None else embedding for embedding in embeddings]
+        return embeddings
+
+    async def embed_uncached(self, texts: list[str]) -> list[Embedding]:
+        unique = list(dict.fromkeys(texts))
+        fresh = await self.internal_embed_many(unique)
+        if self.cache is not None:
+            await self.cache.set_many(self.MODEL, unique, fresh)
+        fresh = dict(zip(unique, fresh))
+        return [fresh[text] for text in texts]
+
+    async def internal_embed_many(self, texts: list[str]) -> list[Embedding]:
+        return list(await asyncio.gather(*[self.internal_embed(text) for text in texts]))
+
+    async def internal_embed(self, text: str) -> Embedding:
         pass
 
     def vector_size(self) -> int:
         pass
 
     def print_total_usage(self) -> None:
-        pass
\ No newline at end of file
+        if self.cache is not None:
+            self.cache.print_stats()
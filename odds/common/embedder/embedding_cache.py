@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from pathlib import Path
+import asyncio
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+from ..datatypes import Embedding
+
+
+class EmbeddingCache:
+
+    # Embeddings keyed by a hash of (model, text) - an in-memory LRU in front of a sqlite file.
+    # The sqlite file is only accessed from worker threads, one at a time.
+
+    def __init__(self, path: Path, max_items=10000) -> None:
+        self.path = path
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def getDB(self) -> sqlite3.Connection:
+        if self.db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)')
+        return self.db
+
+    def key(self, model: str, text: str) -> str:
+        return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+    def remember(self, key: str, embedding: Embedding) -> None:
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    async def get_many(self, model: str, texts: list[str]) -> list[Embedding]:
+        keys = [self.key(model, text) for text in texts]
+        found = dict()
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                found[key] = self.memory[key]
+        missing = list(set(keys) - set(found))
+        if missing:
+            for key, embedding in (await asyncio.to_thread(self.disk_get, missing)).items():
+                found[key] = embedding
+                self.remember(key, embedding)
+        embeddings = [found.get(key) for key in keys]
+        hits = sum(1 for e in embeddings if e is not None)
+        self.hits += hits
+        self.misses += len(embeddings) - hits
+        return embeddings
+
+    def disk_get(self, keys: list[str]) -> dict[str, Embedding]:
+        found = dict()
+        with self.db_lock:
+            db = self.getDB()
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                rows = db.execute(f'SELECT key, vector FROM embeddings WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32).copy()
+        return found
+
+    async def set_many(self, model: str, texts: list[str], embeddings: list[Embedding]) -> None:
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            if embedding is not None:
+                key = self.key(model, text)
+                embedding = np.asarray(embedding, dtype=np.float32)
+                self.remember(key, embedding)
+                rows.append((key, embedding.tobytes()))
+        if rows:
+            await asyncio.to_thread(self.disk_set, rows)
+
+    def disk_set(self, rows: list[tuple[str, bytes]]) -> None:
+        with self.db_lock:
+            db = self.getDB()
+            db.executemany('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)', rows)
+            db.commit()
+
+    def print_stats(self) -> None:
+        total = self.hits + self.misses
+        if total:
+            print(f'embedding cache: {self.hits}/{total} hits ({100 * self.hits / total:.0f}%)')
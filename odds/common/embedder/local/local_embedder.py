@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ...datatypes import Embedding
+
+from ..embedder import Embedder
+from ...config import config
+
+
+VECTOR_SIZE = 1024
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CHAR_NGRAMS = (3, 4, 5)
+# Batches larger than this are split across worker processes
+PARALLEL_MIN_BATCH = 256
+
+
+def features(text: str) -> Counter:
+    # Word unigrams and bigrams, plus character n-grams of each (padded) word
+    words = WORD_RE.findall(text.lower())
+    ret = Counter(f'w:{w}' for w in words)
+    ret.update(f'b:{a} {b}' for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f'<{word}>'
+        for n in CHAR_NGRAMS:
+            ret.update(f'c:{padded[i:i+n]}' for i in range(len(padded) - n + 1))
+    return ret
+
+
+def hashed_vector(text: str, vector_size: int) -> np.ndarray:
+    # Signed feature hashing with sublinear term frequencies, L2 normalized.
+    # blake2b keeps the projection stable across processes and runs (unlike hash()).
+    vector = np.zeros(vector_size, dtype=np.float32)
+    for feature, count in features(text).items():
+        digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+        sign = 1.0 if digest & 1 else -1.0
+        weight = 1.0 + math.log(count)
+        if feature[0] == 'c':
+            weight *= 0.5
+        vector[(digest >> 1) % vector_size] += sign * weight
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def hashed_vectors(texts: list[str], vector_size: int) -> list[np.ndarray]:
+    return [hashed_vector(text, vector_size) for text in texts]
+
+
+class LocalEmbedder(Embedder):
+
+    # CPU only embedder, requiring no network access or models.
+    # Good enough for lexical similarity of titles and search terms, and for offline benchmarks.
+
+    executor: ProcessPoolExecutor = None
+
+    def __init__(self):
+        self.size = config.local_embedder_vector_size or VECTOR_SIZE
+        self.MODEL = f'local-hashed-ngrams-{self.size}'
+        self.workers = config.local_embedder_workers or os.cpu_count() or 1
+        super().__init__()
+
+    async def internal_embed_many(self, texts: list[str]) -> list[Embedding]:
+        embeddings: list[Embedding] = [None] * len(texts)
+        indexes = [i for i, text in enumerate(texts) if text and text.strip()]
+        texts = [texts[i] for i in indexes]
+        if len(texts) < PARALLEL_MIN_BATCH or self.workers < 2:
+            vectors = await asyncio.to_thread(hashed_vectors, texts, self.size)
+        else:
+            if not self.executor:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            loop = asyncio.get_running_loop()
+            chunk_size = math.ceil(len(texts) / self.workers)
+            chunks = await asyncio.gather(*[
+                loop.run_in_executor(self.executor, hashed_vectors, texts[i:i+chunk_size], self.size)
+                for i in range(0, len(texts), chunk_size)
+            ])
+            vectors = [x for y in chunks for x in y]
+        for i, vector in zip(indexes, vectors):
+            embeddings[i] = vector
+        return embeddings
+
+    def vector_size(self) -> int:
+        return self.size
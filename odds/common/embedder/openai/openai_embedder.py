@@ -1,10 +1,11 @@
+import asyncio
 import httpx
 import numpy as np
-import math
 
 from ...datatypes import Embedding
 
 from ..embedder import Embedder
+from ...batcher import MicroBatcher
 from ...cost_collector import CostCollector
 from ...config import config
 from ...retry import Retry
@@ -15,12 +16,39 @@ class OpenAIEmbedder(Embedder):
     MODEL = 'text-embedding-3-small'
     VECTOR_SIZE = 1536
     COST = 0.02/1000000
+    # Inputs sent in a single request
+    MAX_BATCH_SIZE = 256
+
+    batcher: MicroBatcher = None
 
     def __init__(self):
         super().__init__()
         self.cost = CostCollector('openai', {'embed': {'tokens': self.COST}})
 
-    async def embed(self, text: str) -> None:
+    async def embed(self, text: str) -> Embedding:
+        embedding = (await self.lookup([text]))[0]
+        if embedding is not None:
+            return embedding
+        # Concurrent calls are gathered into a single request
+        if not self.batcher:
+            self.batcher = MicroBatcher(
+                self.embed_uncached,
+                max_items=config.embedder_batch_size or self.MAX_BATCH_SIZE,
+                max_delay=config.embedder_batch_delay or 0.01,
+            )
+        return await self.batcher.submit(text)
+
+    async def internal_embed_many(self, texts: list[str]) -> list[Embedding]:
+        chunks = [texts[i:i+self.MAX_BATCH_SIZE] for i in range(0, len(texts), self.MAX_BATCH_SIZE)]
+        results = await asyncio.gather(*[self.internal_embed_chunk(chunk) for chunk in chunks])
+        return [x for y in results for x in y]
+
+    async def internal_embed_chunk(self, texts: list[str]) -> list[Embedding]:
+        embeddings: list[Embedding] = [None] * len(texts)
+        # The API rejects empty inputs
+        indexes = [i for i, text in enumerate(texts) if text and text.strip()]
+        if not indexes:
+            return embeddings
         headers = {
             'Authorization': f'Bearer {config.credentials.openai.key}',
             'OpenAI-Organization': config.credentials.openai.org,
@@ -28,7 +56,7 @@ class OpenAIEmbedder(Embedder):
         }
         request = dict(
             model=self.MODEL,
-            input=text,
+            input=[texts[i] for i in indexes],
         )
         async with httpx.AsyncClient() as client:
             response = await Retry()(client, 'post',
@@ -37,20 +65,22 @@ class OpenAIEmbedder(Embedder):
                 headers=headers,
                 timeout=60,
             )
-            response.raise_for_status()
+            if response is None:
+                return embeddings
             result = response.json()
-            if result['usage']:
+            if result.get('usage'):
                 self.cost.start_transaction()
                 self.cost.update_cost('embed', 'tokens', result['usage']['total_tokens'])
                 self.cost.end_transaction()
-            if result.get('data') and result['data'][0].get('object') == 'embedding' and result['data'][0]['embedding']:
-                vector: list[float] = result['data'][0]['embedding']
-                embedding: Embedding = np.array(vector, dtype=np.float32)
-                return embedding
-            return None
-    
+            for item in result.get('data') or []:
+                if item.get('object') == 'embedding' and item.get('embedding'):
+                    vector: list[float] = item['embedding']
+                    embeddings[indexes[item['index']]] = np.array(vector, dtype=np.float32)
+            return embeddings
+
     def print_total_usage(self):
+        super().print_total_usage()
         self.cost.print_total_usage()
 
     def vector_size(self) -> int:
-        return self.VECTOR_SIZE
\ No newline at end of file
+        return self.VECTOR_SIZE
@@ -2,6 +2,7 @@ import atexit
 from .llm_runner import LLMRunner
 from .openai.openai_llm_runner import OpenAILLMRunner
 from .mistral.mistral_llm_runner import MistralLLMRunner
+from .stub.stub_llm_runner import StubLLMRunner
 from ..select import select
 
 llm_runner: LLMRunner = select('LLMRunner', locals())()
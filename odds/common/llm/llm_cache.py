@@ -2,45 +2,34 @@ import json
 import hashlib
 from kvfile.kvfile_leveldb import KVFileLevelDB as KVFile
 from ..config import config, CACHE_DIR
+from .llm_log_writer import LLMLogWriter
 
 class LLMCache():
 
     def __init__(self, name) -> None:
         self.log = None
         self.cache = None
-        self.logfile = None
         if config.debug:
-            self.logfile = (CACHE_DIR / f'{name}_llm_runner.log').open('w')
-            self.log = {}
+            self.log = LLMLogWriter(
+                CACHE_DIR / f'{name}_llm_runner.log.jsonl',
+                max_bytes=config.llm_log_max_bytes or 50000000,
+                backups=config.llm_log_backups or 5,
+            )
             self.cache = KVFile(location=str(CACHE_DIR / f'{name}_llm_runner.cache'))
 
     def store_log(self, conversation, prompts):
         if self.log is not None:
-            o = self.log
-            for x in conversation:
-                o = o.setdefault(x, {})
-            o = o.setdefault('@', [])
             for p in prompts:
-                o.append(f'>>> {p[0]}\n{p[1]}')
+                self.log.write(conversation, p[0], p[1])
 
     def store_error(self, conversation):
         self.store_log(conversation, [('assistant', 'ERROR')])
-
-    def aux_log_writer(self, o, breadcrumbs=''):
-        if '@' in o:
-            self.logfile.write(f'{breadcrumbs}:\n')
-            self.logfile.write('\n'.join(o['@']))
-            self.logfile.write('\n')
-            for k, v in o.items():
-                if k != '@' and isinstance(v, dict):
-                    self.aux_log_writer(v, f'{breadcrumbs}.{k}')
+        if self.log is not None:
+            self.log.flush()
 
     def dump_log(self):
-        print('DUMPING LOG', self.logfile, len(self.log))
-        if self.logfile:
-            for k in self.log.keys():
-                self.aux_log_writer(self.log[k])
-            self.logfile.close()
+        if self.log is not None:
+            self.log.close()
 
     def cache_key(self, request):
         key = json.dumps(request, sort_keys=True)
@@ -58,4 +47,4 @@ class LLMCache():
     def set_cache(self, request, content):
         if self.cache is not None:
             key = self.cache_key(request)
-            self.cache.set(key, content)
\ No newline at end of file
+            self.cache.set(key, content)
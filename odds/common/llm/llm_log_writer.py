@@ -0,0 +1,71 @@
+import json
+import os
+import time
+from pathlib import Path
+
+
+class LLMLogWriter():
+
+    # Append-only JSONL log of conversations, one record per message.
+    # Records are buffered and flushed when the buffer fills up, when the last
+    # flush is older than flush_interval seconds, or on errors. The file is
+    # rotated to .1, .2, ... once it grows beyond max_bytes.
+
+    def __init__(self, path: Path, max_bytes=50000000, backups=5, buffer_size=65536, flush_interval=1.0) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = time.time()
+        self.file = None
+        self.size = 0
+        self.open()
+
+    def open(self) -> None:
+        self.file = self.path.open('a', encoding='utf-8')
+        self.size = self.file.tell()
+
+    def write(self, conversation: list[str], role: str, content: str) -> None:
+        record = json.dumps(dict(
+            ts=time.time(),
+            path=list(conversation),
+            role=role,
+            content=content,
+        ), ensure_ascii=False) + '\n'
+        self.buffer.append(record)
+        self.buffered += len(record.encode('utf-8'))
+        if self.buffered >= self.buffer_size or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self.last_flush = time.time()
+        if not self.buffer or self.file is None:
+            return
+        if self.size > 0 and self.size + self.buffered > self.max_bytes:
+            self.rotate()
+        self.file.write(''.join(self.buffer))
+        self.file.flush()
+        self.size += self.buffered
+        self.buffer = []
+        self.buffered = 0
+
+    def rotate(self) -> None:
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f'{self.path.name}.{i}')
+            if src.exists():
+                os.replace(src, self.path.with_name(f'{self.path.name}.{i + 1}'))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f'{self.path.name}.1'))
+        else:
+            self.path.unlink()
+        self.open()
+
+    def close(self) -> None:
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
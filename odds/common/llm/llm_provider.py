@@ -0,0 +1,80 @@
+from typing import AsyncIterator
+import json
+import httpx
+
+from .llm_query import LLMQuery
+from ..retry import Retry
+
+
+class LLMProvider:
+
+    # Adapter for a chat completions API - the runner takes care of everything else
+
+    NAME = None
+    URL = None
+    MODELS = dict()
+    COSTS = dict()
+
+    def headers(self) -> dict:
+        return {
+            'Content-Type': 'application/json'
+        }
+
+    def build_request(self, query: LLMQuery, prompt: list[tuple[str, str]]) -> dict:
+        return dict(
+            model=self.MODELS[query.model()],
+            messages=[
+                dict(
+                    role=p[0],
+                    content=p[1]
+                )
+                for p in prompt
+            ],
+            temperature=query.temperature()
+        )
+
+    async def fetch(self, request: dict) -> dict:
+        async with httpx.AsyncClient() as client:
+            response = await Retry()(client, 'post',
+                self.URL,
+                json=request,
+                headers=self.headers(),
+                timeout=240,
+            )
+            if response is not None:
+                return response.json()
+
+    def build_stream_request(self, request: dict) -> dict:
+        return dict(request, stream=True)
+
+    async def stream(self, request: dict) -> AsyncIterator[dict]:
+        # Server-sent events, one JSON chunk per `data:` line until `data: [DONE]`
+        async with httpx.AsyncClient() as client:
+            async with client.stream('POST', self.URL, json=request, headers=self.headers(), timeout=240) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        break
+                    try:
+                        yield json.loads(data)
+                    except json.JSONDecodeError:
+                        print('ERROR PARSING CHUNK', data)
+
+    def parse_delta(self, chunk: dict) -> str:
+        if chunk.get('choices') and chunk['choices'][0].get('delta'):
+            return chunk['choices'][0]['delta'].get('content')
+
+    def parse_usage(self, result: dict) -> dict:
+        usage = result.get('usage')
+        if usage:
+            return dict(
+                prompt=usage['prompt_tokens'],
+                completion=usage['completion_tokens']
+            )
+
+    def parse_content(self, result: dict) -> str:
+        if result.get('choices') and result['choices'][0].get('message') and result['choices'][0]['message'].get('content'):
+            return result['choices'][0]['message']['content']
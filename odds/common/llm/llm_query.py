@@ -2,6 +2,10 @@ from typing import Any
 from ..datatypes import Dataset, DataCatalog
 
 
+# Smallest context window among the configured models
+CONTEXT_WINDOW = 16384
+
+
 class LLMQuery():
 
     def __init__(self, dataset: Dataset, catalog: DataCatalog):
@@ -26,6 +30,9 @@ class LLMQuery():
     def max_tokens(self) -> int:
         return 2048
 
+    def max_prompt_tokens(self) -> int:
+        return CONTEXT_WINDOW - self.max_tokens()
+
 
 class CustomLLMQuery(LLMQuery):
 
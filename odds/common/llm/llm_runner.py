@@ -1,12 +1,160 @@
+from typing import Any, AsyncIterator
+import json
+
 from .llm_query import LLMQuery
 from .llm_cache import LLMCache
+from .llm_provider import LLMProvider
+from .prompt_builder import fit_prompt
 from ..cost_collector import CostCollector
 
-class LLMRunner:
 
-    def __init__(self, name, costs) -> None:
-        self.cache = LLMCache(name)
-        self.cost_collector = CostCollector(name, costs)
+def parse_json(content: str) -> Any:
+    parsed = None
+    try:
+        parsed = json.loads(content)
+    except:
+        pass
+    try:
+        selected_brackets_p = None
+        selected_brackets = None
+        for brackets in ['[]', '{}']:
+            if brackets[0] in content and brackets[1] in content and (selected_brackets_p is None or content.index(brackets[0]) < selected_brackets_p):
+                selected_brackets_p = content.index(brackets[0])
+                selected_brackets = brackets
 
-    async def run(self, query: LLMQuery, conversation=[]) -> None:
+        if selected_brackets is not None:
+            content = content[content.index(selected_brackets[0]):content.rindex(selected_brackets[1])+1]
+            parsed = json.loads(content)
+    except:
         pass
+    return parsed
+
+
+def parse_partial_json(content: str) -> Any:
+    # Best effort parsing of an incomplete JSON document, by closing any open
+    # strings and brackets after the last complete value. Numbers and literals are
+    # only complete once followed by a delimiter, so they never show up truncated.
+    starts = [content.index(c) for c in '[{' if c in content]
+    if not starts:
+        return None
+    text = content[min(starts):]
+    stack = []
+    in_string = False
+    escape = False
+    cuts = []
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+                cuts.append((i + 1, list(stack)))
+            continue
+        if c == '"':
+            in_string = True
+        elif c in '[{':
+            stack.append(']' if c == '[' else '}')
+            cuts.append((i + 1, list(stack)))
+        elif c in ']}':
+            if stack:
+                stack.pop()
+            cuts.append((i + 1, list(stack)))
+        elif c == ',':
+            cuts.append((i, list(stack)))
+    candidates = []
+    if in_string:
+        candidates.append((text[:-1] if escape else text) + '"' + ''.join(reversed(stack)))
+    candidates.extend(
+        text[:end].rstrip().rstrip(',') + ''.join(reversed(closers))
+        for end, closers in reversed(cuts[-8:])
+    )
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+class LLMRunner:
+
+    def __init__(self, provider: LLMProvider) -> None:
+        self.provider = provider
+        self.cache = LLMCache(provider.NAME)
+        self.cost_collector = CostCollector(provider.NAME, provider.COSTS)
+
+    def record_usage(self, query: LLMQuery, usage: dict) -> None:
+        if usage:
+            self.cost_collector.start_transaction()
+            for kind, tokens in usage.items():
+                self.cost_collector.update_cost(query.model(), kind, tokens)
+            self.cost_collector.end_transaction()
+
+    async def internal_fetch_data(self, request: dict, query: LLMQuery) -> Any:
+        cached = self.cache.get_cache(request)
+        if cached is not None:
+            return cached
+        result = await self.provider.fetch(request)
+        if result is not None:
+            self.record_usage(query, self.provider.parse_usage(result))
+            content = self.provider.parse_content(result)
+            if content:
+                self.cache.set_cache(request, content)
+                return content
+
+    def prepare_request(self, query: LLMQuery, conversation: list[str]) -> dict:
+        prompt = fit_prompt(query.prompt(), query.max_prompt_tokens())
+        self.cache.store_log(conversation, prompt)
+        return self.provider.build_request(query, prompt)
+
+    def handle_content(self, query: LLMQuery, content: str, conversation: list[str]) -> Any:
+        if content is not None:
+            self.cache.store_log(conversation, [('assistant', content)])
+            if query.expects_json():
+                parsed = parse_json(content)
+            else:
+                parsed = content
+            if parsed is None:
+                print('ERROR PARSING RESULT', query.dataset, content)
+            else:
+                return query.handle_result(parsed)
+        else:
+            self.cache.store_error(conversation)
+            return query.handle_result(None)
+
+    async def run(self, query: LLMQuery, conversation=[]) -> Any:
+        request = self.prepare_request(query, conversation)
+        content = await self.internal_fetch_data(request, query)
+        return self.handle_content(query, content, conversation)
+
+    async def run_stream(self, query: LLMQuery, conversation=[]) -> AsyncIterator[tuple[bool, Any]]:
+        # Yields (False, partial) while the response streams in - the raw text so far,
+        # or the partially parsed JSON for queries expecting JSON - and then (True, result).
+        request = self.prepare_request(query, conversation)
+        content = self.cache.get_cache(request)
+        if content is None:
+            content = ''
+            usage = None
+            last = None
+            try:
+                async for chunk in self.provider.stream(self.provider.build_stream_request(request)):
+                    usage = self.provider.parse_usage(chunk) or usage
+                    delta = self.provider.parse_delta(chunk)
+                    if not delta:
+                        continue
+                    content += delta
+                    partial = parse_partial_json(content) if query.expects_json() else content
+                    if partial is not None and partial != last:
+                        last = partial
+                        yield False, partial
+            except Exception as e:
+                print('ERROR STREAMING', repr(e))
+                content = None
+            self.record_usage(query, usage)
+            if content:
+                self.cache.set_cache(request, content)
+            else:
+                content = None
+        yield True, self.handle_content(query, content, conversation)
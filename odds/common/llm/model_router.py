@@ -0,0 +1,52 @@
+from collections import deque
+
+
+class ModelRouter():
+
+    # Routes queries to the cheapest model tier whose recent success rate is acceptable.
+    # Tiers are ordered cheapest first; a tier which keeps failing is skipped,
+    # but is still probed every once in a while so it can recover.
+
+    def __init__(self, name, tiers=('cheap', 'expensive'), min_success_rate=0.5, min_samples=20, window=100, probe_every=10) -> None:
+        self.name = name
+        self.tiers = tiers
+        self.min_success_rate = min_success_rate
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+        self.recent = dict((tier, deque(maxlen=window)) for tier in tiers)
+        self.totals = dict((tier, [0, 0]) for tier in tiers)
+        self.skipped = 0
+
+    def success_rate(self, tier) -> float:
+        recent = self.recent[tier]
+        if len(recent) < self.min_samples:
+            return None
+        return sum(recent) / len(recent)
+
+    def route(self) -> str:
+        for tier in self.tiers[:-1]:
+            rate = self.success_rate(tier)
+            if rate is None or rate >= self.min_success_rate:
+                return tier
+            self.skipped += 1
+            if self.skipped % self.probe_every == 0:
+                return tier
+        return self.tiers[-1]
+
+    def next_tier(self, tier) -> str:
+        idx = self.tiers.index(tier)
+        if idx + 1 < len(self.tiers):
+            return self.tiers[idx + 1]
+        return None
+
+    def record(self, tier, success: bool) -> None:
+        self.recent[tier].append(1 if success else 0)
+        self.totals[tier][0] += 1 if success else 0
+        self.totals[tier][1] += 1
+
+    def print_stats(self) -> None:
+        msg = f'{self.name} routing:'
+        for tier, (successes, total) in self.totals.items():
+            if total:
+                msg += f'\n{tier}: {successes}/{total} succeeded ({100 * successes / total:.0f}%)'
+        print(msg)
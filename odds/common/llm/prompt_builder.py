@@ -0,0 +1,76 @@
+import tiktoken
+
+
+ENCODING_NAME = 'cl100k_base'
+ELLIPSIS = '...'
+# Rough size of a token, for when the encoding can't be loaded
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_failed = False
+
+
+def get_encoding() -> tiktoken.Encoding:
+    # Loaded lazily, as tiktoken fetches the BPE ranks on first use (unless they're
+    # already in TIKTOKEN_CACHE_DIR). Returns None if they can't be loaded.
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception as e:
+            print('FAILED TO LOAD TOKEN ENCODING, ESTIMATING TOKENS BY LENGTH', repr(e))
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if not text:
+        return text
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max(max_tokens, 0)])
+
+
+def fit_lines(lines: list[str], max_tokens: int, ellipsis=ELLIPSIS, head_ratio=0.75) -> list[str]:
+    # Keep as many lines as possible from the head and the tail of the list,
+    # marking the gap with an ellipsis. Every line is measured exactly once.
+    counts = [count_tokens(line) + 1 for line in lines]
+    if sum(counts) <= max_tokens:
+        return lines
+    budget = max_tokens - count_tokens(ellipsis) - 1
+    head_budget = int(budget * head_ratio)
+    head = 0
+    used = 0
+    while head < len(lines) and used + counts[head] <= head_budget:
+        used += counts[head]
+        head += 1
+    tail = len(lines)
+    while tail > head and used + counts[tail - 1] <= budget:
+        used += counts[tail - 1]
+        tail -= 1
+    return lines[:head] + [ellipsis] + lines[tail:]
+
+
+def fit_prompt(prompt: list[tuple[str, str]], max_tokens: int) -> list[tuple[str, str]]:
+    # Last line of defence against overflowing the context window:
+    # the final message (where the payload lives) is truncated to fit.
+    counts = [count_tokens(content) for _, content in prompt]
+    total = sum(counts)
+    if total <= max_tokens or not prompt:
+        return prompt
+    role, content = prompt[-1]
+    allowed = max_tokens - (total - counts[-1])
+    return prompt[:-1] + [(role, truncate_tokens(content, allowed))]
@@ -0,0 +1,122 @@
+from typing import AsyncIterator
+import asyncio
+import json
+import re
+
+from ..llm_runner import LLMRunner
+from ..llm_provider import LLMProvider
+from ...config import config
+
+
+DESCRIPTION = dict(
+    summary='Data of a stub dataset, generated for benchmarking',
+    description='This is a canned description of the dataset, returned by the local stub LLM provider without calling any external API.',
+)
+
+
+def describe_batch(prompt: str) -> str:
+    keys = re.findall(r'^(D\d+):$', prompt, re.MULTILINE)
+    return json.dumps(dict((key, DESCRIPTION) for key in keys))
+
+
+def select_first_dataset(prompt: str) -> str:
+    ids = re.findall(r'^Datasets:\n(\S+):$', prompt, re.MULTILINE)
+    return json.dumps([dict(id=id, reason='stub', score=10) for id in ids[:1]])
+
+
+STREAM_CHUNK_SIZE = 16
+
+# Canned responses, matched in order against the prompt
+DEFAULT_RESPONSES = [
+    ('Provide a summary of each dataset', describe_batch),
+    ('Provide a summary of this dataset', json.dumps(DESCRIPTION)),
+    ('extract the 3 most crucial stand alone claims', json.dumps([dict(
+        quote='The unemployment rate went down by two percent',
+        geo='Canada',
+        claim='The unemployment rate in Canada decreased by 2 percent in 2023.',
+        sources='unemployment rates are published periodically by Statistics Canada'
+    )])),
+    ('separately verifiable claims', json.dumps(['The unemployment rate in Canada decreased by 2 percent in 2023.'])),
+    ('singular data points', json.dumps(['The unemployment rate in Canada in 2022', 'The unemployment rate in Canada in 2023'])),
+    ('possible official dataset titles', json.dumps(['Labour force characteristics', 'Unemployment rate by province'])),
+    ('Please rate the following datasets', select_first_dataset),
+    ('Please rate the following data files', json.dumps([dict(id='file00', reason='stub', score=10)])),
+    ('create SQL query', 'NO QUERY'),
+    ('Generate a statement', 'The requested data point could not be determined from the data provided.'),
+    ('Analyze the claim', json.dumps(dict(
+        verdict=50, certainty=0,
+        verdict_explanation='stub verdict', certainty_explanation='stub certainty'
+    ))),
+]
+
+
+class StubProvider(LLMProvider):
+
+    # Deterministic, offline provider for load testing the pipeline.
+    # Latency is a fixed delay plus an optional simulated generation speed.
+
+    NAME = 'stub'
+    MODELS = dict(
+        cheap='stub-cheap',
+        expensive='stub-expensive',
+    )
+    COSTS = dict(
+        cheap=dict(
+            prompt=0,
+            completion=0
+        ),
+        expensive=dict(
+            prompt=0,
+            completion=0
+        ),
+    )
+
+    def __init__(self) -> None:
+        self.latency = config.stub_llm_latency if config.stub_llm_latency is not None else 0.2
+        self.tokens_per_second = config.stub_llm_tokens_per_second or 0
+        self.responses = [
+            (r['pattern'], r['response'])
+            for r in (config.stub_llm_responses or [])
+        ] + DEFAULT_RESPONSES
+
+    def estimate_tokens(self, text: str) -> int:
+        return len(text) // 4 + 1
+
+    def respond(self, prompt: str) -> str:
+        for pattern, response in self.responses:
+            if re.search(pattern, prompt):
+                return response(prompt) if callable(response) else response
+        return '{}'
+
+    def complete(self, request: dict) -> tuple[str, dict]:
+        prompt = '\n'.join(message['content'] for message in request['messages'])
+        content = self.respond(prompt)
+        usage = dict(prompt_tokens=self.estimate_tokens(prompt), completion_tokens=self.estimate_tokens(content))
+        return content, usage
+
+    async def fetch(self, request: dict) -> dict:
+        content, usage = self.complete(request)
+        latency = self.latency
+        if self.tokens_per_second:
+            latency += usage['completion_tokens'] / self.tokens_per_second
+        await asyncio.sleep(latency)
+        return dict(
+            choices=[dict(message=dict(role='assistant', content=content))],
+            usage=usage,
+        )
+
+    async def stream(self, request: dict) -> AsyncIterator[dict]:
+        content, usage = self.complete(request)
+        await asyncio.sleep(self.latency)
+        for i in range(0, len(content), STREAM_CHUNK_SIZE):
+            piece = content[i:i+STREAM_CHUNK_SIZE]
+            if self.tokens_per_second:
+                await asyncio.sleep(self.estimate_tokens(piece) / self.tokens_per_second)
+            yield dict(choices=[dict(delta=dict(content=piece))])
+        yield dict(choices=[], usage=usage)
+
+
+class StubLLMRunner(LLMRunner):
+
+    def __init__(self):
+        super().__init__(StubProvider())
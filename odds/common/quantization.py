@@ -0,0 +1,123 @@
+from io import BytesIO
+
+import numpy as np
+
+from .datatypes import Embedding
+
+
+FORMATS = ('float32', 'float16', 'int8')
+
+
+def quantize(vectors: np.ndarray, format: str) -> tuple[np.ndarray, np.ndarray]:
+    # Returns the codes and a per-vector scale (None unless int8)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if format == 'float16':
+        return vectors.astype(np.float16), None
+    if format == 'int8':
+        scale = np.abs(vectors).max(axis=-1, keepdims=True) / 127
+        scale[scale == 0] = 1
+        codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+        return codes, scale.astype(np.float32)
+    return vectors, None
+
+
+def dequantize(codes: np.ndarray, scale: np.ndarray = None) -> np.ndarray:
+    vectors = codes.astype(np.float32)
+    if scale is not None:
+        vectors *= scale
+    return vectors
+
+
+def encode_embedding(embedding: Embedding, format: str) -> bytes:
+    # float32/float16 are plain .npy files, int8 is an .npz with the codes and their scale
+    codes, scale = quantize(embedding, format)
+    out = BytesIO()
+    if scale is None:
+        np.save(out, codes)
+    else:
+        np.savez(out, codes=codes, scale=scale)
+    return out.getvalue()
+
+
+def decode_embedding(content: bytes) -> Embedding:
+    # Reads all formats written by encode_embedding, including existing float32 .npy files
+    loaded = np.load(BytesIO(content))
+    if isinstance(loaded, np.lib.npyio.NpzFile):
+        return dequantize(loaded['codes'], loaded['scale'])
+    return dequantize(loaded)
+
+
+class QuantizedVectors:
+
+    # A matrix of quantized vectors searched by (approximate) dot product.
+    # When the full precision vectors are available, the best candidates are rescored using them.
+
+    def __init__(self, vectors: np.ndarray, format: str = 'int8', oversample: int = 4) -> None:
+        self.format = format
+        self.oversample = oversample
+        self.codes, self.scale = quantize(vectors, format)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def append(self, vectors: np.ndarray) -> None:
+        codes, scale = quantize(vectors, self.format)
+        self.codes = np.concatenate([self.codes, codes])
+        if scale is not None:
+            self.scale = np.concatenate([self.scale, scale])
+
+    def scores(self, queries: np.ndarray, rows=None) -> np.ndarray:
+        # rows - a slice or an array of row numbers
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.asarray(queries, dtype=np.float32) @ codes.astype(np.float32).T
+        if self.scale is not None:
+            scale = self.scale if rows is None else self.scale[rows]
+            scores *= scale.T
+        return scores
+
+    def search(self, query: np.ndarray, k: int, full_precision=None) -> tuple[np.ndarray, np.ndarray]:
+        rows, scores = self.search_many(np.asarray(query)[None, :], k, full_precision)
+        return rows[0], scores[0]
+
+    def search_many(self, queries: np.ndarray, k: int, full_precision=None, chunk_size=65536, rows: np.ndarray = None) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        # Returns the row numbers and scores of the top k vectors for each query.
+        # full_precision - an array (or memmap) of the original vectors, or a callable taking row numbers
+        # rows - only search these rows
+        queries = np.asarray(queries, dtype=np.float32)
+        candidates = k * self.oversample if full_precision is not None else k
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self) if rows is None else len(rows), chunk_size):
+            chunk = slice(start, start + chunk_size) if rows is None else rows[start:start + chunk_size]
+            idx, scores = top_k(self.scores(queries, chunk), candidates)
+            idx = idx + start if rows is None else chunk[idx]
+            best_rows, best_scores = merge_top_k(best_rows, best_scores, idx, scores, candidates)
+        if full_precision is None:
+            return list(best_rows), list(best_scores)
+        ret_rows, ret_scores = [], []
+        for query, rows in zip(queries, best_rows):
+            # Sorted rows make for sequential reads from memory mapped files
+            rows = np.sort(rows)
+            vectors = full_precision(rows) if callable(full_precision) else full_precision[rows]
+            scores = np.asarray(vectors, dtype=np.float32) @ query
+            order = np.argsort(-scores)[:k]
+            ret_rows.append(rows[order])
+            ret_scores.append(scores[order])
+        return ret_rows, ret_scores
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    # Column numbers and values of the k largest values in each row of scores, largest first
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((len(scores), 0), dtype=np.int64), np.zeros((len(scores), 0), dtype=np.float32)
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    selected = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-selected, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(selected, order, axis=1)
+
+
+def merge_top_k(rows_a: np.ndarray, scores_a: np.ndarray, rows_b: np.ndarray, scores_b: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    rows = np.concatenate([rows_a, rows_b], axis=1)
+    idx, scores = top_k(np.concatenate([scores_a, scores_b], axis=1), k)
+    return np.take_along_axis(rows, idx, axis=1), scores
@@ -1,6 +1,13 @@
 from .store import Store
 from ..select import select
+from ..config import config, CACHE_DIR
 from .fs.fs_store import FSStore
 from .s3.s3_store import S3Store
+from .cached_store import CachedStore
 
-store: Store = select('Store', locals())()
\ No newline at end of file
+store: Store = select('Store', locals())()
+
+if not config.disable_dataset_cache:
+    store = CachedStore(store, CACHE_DIR / 'dataset_cache.sqlite',
+                        max_items=config.dataset_cache_size or 1000, ttl=config.dataset_cache_ttl or 60,
+                        max_disk_items=config.dataset_cache_disk_size or 100000)
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from pathlib import Path
+import asyncio
+import atexit
+import copy
+import pickle
+import sqlite3
+import threading
+import time
+
+from .store import Store
+from ..datatypes import Dataset, Embedding, Resource
+
+
+class CachedStore(Store):
+
+    # Read-through cache of datasets in front of another store - an in-memory LRU of parsed
+    # datasets, backed by a sqlite file. Entries younger than `ttl` seconds are served as is,
+    # older ones are revalidated against the store's version (ETag, mtime) and only downloaded
+    # again if they changed. Callers get copies, so they're free to modify what they get.
+    # The sqlite tier holds up to `max_disk_items` entries, pruning the least recently used, and
+    # is only accessed from worker threads.
+
+    # Disk entries are pruned once this many writes went by
+    PRUNE_EVERY = 100
+
+    def __init__(self, store: Store, path: Path, max_items=1000, ttl=60, max_disk_items=100000) -> None:
+        self.store = store
+        self.path = path
+        self.max_items = max_items
+        self.max_disk_items = max_disk_items
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.writes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        atexit.register(self.print_stats)
+
+    def connect_db(self) -> sqlite3.Connection:
+        if self.db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(datasets)')]
+            if columns and 'used' not in columns:
+                # Created by an older version - it's only a cache
+                self.db.execute('DROP TABLE datasets')
+            self.db.execute('CREATE TABLE IF NOT EXISTS datasets (id TEXT PRIMARY KEY, version TEXT, dataset BLOB, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS datasets_used ON datasets (used)')
+        return self.db
+
+    def remember(self, datasetId: str, dataset: Dataset, version: str) -> None:
+        self.memory[datasetId] = (dataset, version, time.time())
+        self.memory.move_to_end(datasetId)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    async def lookup(self, datasetId: str) -> tuple[Dataset, str, float]:
+        if datasetId in self.memory:
+            self.memory.move_to_end(datasetId)
+            return self.memory[datasetId]
+        row = await asyncio.to_thread(self.disk_get, datasetId)
+        if row is not None:
+            try:
+                # Disk entries are always revalidated
+                return pickle.loads(row[1]), row[0], 0
+            except Exception:
+                pass
+        return None, None, 0
+
+    def disk_get(self, datasetId: str) -> tuple[str, bytes]:
+        with self.db_lock:
+            db = self.connect_db()
+            row = db.execute('SELECT version, dataset FROM datasets WHERE id=?', (datasetId,)).fetchone()
+            if row is not None:
+                db.execute('UPDATE datasets SET used=? WHERE id=?', (time.time(), datasetId))
+                db.commit()
+            return row
+
+    async def persist(self, datasetId: str, dataset: Dataset, version: str) -> None:
+        blob = None if dataset is None or version is None else pickle.dumps(dataset)
+        await asyncio.to_thread(self.disk_set, datasetId, version, blob)
+
+    def disk_set(self, datasetId: str, version: str, blob: bytes) -> None:
+        with self.db_lock:
+            db = self.connect_db()
+            if blob is None:
+                db.execute('DELETE FROM datasets WHERE id=?', (datasetId,))
+            else:
+                db.execute('INSERT OR REPLACE INTO datasets (id, version, dataset, used) VALUES (?, ?, ?, ?)',
+                           (datasetId, version, blob, time.time()))
+                self.writes += 1
+                if self.writes % self.PRUNE_EVERY == 0:
+                    self.prune(db)
+            db.commit()
+
+    def prune(self, db: sqlite3.Connection) -> None:
+        excess = db.execute('SELECT COUNT(*) FROM datasets').fetchone()[0] - self.max_disk_items
+        if excess > 0:
+            db.execute('DELETE FROM datasets WHERE id IN (SELECT id FROM datasets ORDER BY used LIMIT ?)', (excess,))
+
+    async def invalidate(self, datasetId: str) -> None:
+        self.memory.pop(datasetId, None)
+        await self.persist(datasetId, None, None)
+
+    async def getDataset(self, datasetId: str) -> Dataset:
+        cached, version, checked = await self.lookup(datasetId)
+        if cached is not None and time.time() - checked < self.ttl:
+            self.hits += 1
+            return copy.deepcopy(cached)
+        dataset, current = await self.store.fetchDataset(datasetId, version if cached is not None else None)
+        if dataset is None and current is not None and cached is not None:
+            self.revalidated += 1
+            dataset = cached
+        else:
+            self.misses += 1
+            await self.persist(datasetId, dataset, current)
+        if dataset is None:
+            self.memory.pop(datasetId, None)
+            return None
+        self.remember(datasetId, dataset, current)
+        return copy.deepcopy(dataset)
+
+    async def fetchDataset(self, datasetId: str, version: str = None) -> tuple[Dataset, str]:
+        return await self.store.fetchDataset(datasetId, version)
+
+    async def hasDataset(self, datasetId: str) -> bool:
+        entry = self.memory.get(datasetId)
+        if entry is not None and time.time() - entry[2] < self.ttl:
+            return True
+        return await self.store.hasDataset(datasetId)
+
+    async def storeDataset(self, dataset: Dataset, ctx: str) -> None:
+        await self.invalidate(dataset.storeId())
+        await self.store.storeDataset(dataset, ctx)
+
+    async def storeDB(self, resource: Resource, dataset: Dataset, dbFile, ctx: str) -> None:
+        await self.store.storeDB(resource, dataset, dbFile, ctx)
+
+    async def storeEmbedding(self, dataset: Dataset, embedding: Embedding, ctx: str) -> None:
+        await self.store.storeEmbedding(dataset, embedding, ctx)
+
+    async def getDB(self, resource: Resource, dataset: Dataset) -> str:
+        return await self.store.getDB(resource, dataset)
+
+    async def getEmbedding(self, dataset: Dataset) -> Embedding:
+        return await self.store.getEmbedding(dataset)
+
+    async def iterDatasets(self, catalogId: str = None):
+        async for dataset in self.store.iterDatasets(catalogId):
+            yield dataset
+
+    async def iterEmbeddings(self, catalogId: str = None):
+        async for item in self.store.iterEmbeddings(catalogId):
+            yield item
+
+    async def buildPackfiles(self, catalogIds: list[str]) -> None:
+        await self.store.buildPackfiles(catalogIds)
+
+    async def close(self) -> None:
+        await self.store.close()
+
+    def __getattr__(self, name):
+        # Anything else is specific to the wrapped store
+        return getattr(self.store, name)
+
+    def print_stats(self) -> None:
+        total = self.hits + self.revalidated + self.misses
+        if total:
+            print(f'dataset cache: {self.hits}/{total} hits ({100 * self.hits / total:.0f}%), {self.revalidated} revalidated, {self.misses} fetched')
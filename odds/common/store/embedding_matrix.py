@@ -0,0 +1,223 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import fcntl
+import json
+import re
+import threading
+
+import numpy as np
+
+from ..datatypes import Embedding
+from ..quantization import quantize, dequantize
+
+
+class EmbeddingMatrix:
+
+    # All embeddings of a single catalog: an append-only raw matrix (vectors.bin) and a table
+    # of ids (ids.txt, one per line, row number = line number). int8 matrices keep their
+    # per-row scales in scales.f32. Re-stored embeddings are overwritten in place, reads go
+    # through a memory map. Rows are written before their id, so partial writes are ignored.
+    # Mirrors of a remote store may record the version (e.g. ETag) each row was copied at, in an
+    # append-only versions.txt of `id<TAB>version` lines, where the last line for an id wins.
+    # Several threads and processes may write to the same matrix: writes hold a file lock on the
+    # directory (matrix.lock) and pick up rows appended by others before assigning new row numbers.
+
+    def __init__(self, path: Path, format: str = 'float32') -> None:
+        self.path = path
+        self.vectors_file = path / 'vectors.bin'
+        self.scales_file = path / 'scales.f32'
+        self.ids_file = path / 'ids.txt'
+        self.meta_file = path / 'meta.json'
+        self.versions_file = path / 'versions.txt'
+        self.lock_file = path / 'matrix.lock'
+        self.lock = threading.RLock()
+        self.format = format
+        self.vector_size = None
+        self.ids = []
+        self.rows = dict()
+        self.ids_size = 0
+        self.versions = dict()
+        self.versions_size = 0
+        self.mmap = None
+        self.scales = None
+        self.read_meta()
+        self.refresh()
+
+    def read_meta(self) -> None:
+        if self.meta_file.exists():
+            meta = json.loads(self.meta_file.read_text())
+            self.vector_size = meta['vector_size']
+            self.format = meta['format']
+
+    @contextmanager
+    def locked(self):
+        # Exclusive across threads and processes
+        with self.lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_file, 'a') as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.format)
+
+    def refresh(self) -> None:
+        # Picks up rows appended since the last read (possibly by another process)
+        with self.lock:
+            for line in self.read_appended(self.versions_file, 'versions_size'):
+                id, _, version = line.partition('\t')
+                self.versions[id] = version
+            lines = self.read_appended(self.ids_file, 'ids_size')
+            if not lines:
+                return
+            for line in lines:
+                self.rows[line] = len(self.ids)
+                self.ids.append(line)
+            self.mmap = None
+            self.scales = None
+
+    def read_appended(self, filename: Path, size_attr: str) -> list[str]:
+        # Complete lines appended to the file since it was last read
+        size = getattr(self, size_attr)
+        if not filename.exists() or filename.stat().st_size == size:
+            return []
+        with filename.open('rb') as file:
+            file.seek(size)
+            content = file.read()
+        complete = content[:content.rfind(b'\n') + 1]
+        setattr(self, size_attr, size + len(complete))
+        return complete.decode('utf-8').splitlines()
+
+    def version(self, id: str) -> str:
+        self.refresh()
+        return self.versions.get(id)
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.ids)
+
+    def load(self) -> tuple[np.ndarray, np.ndarray]:
+        # The current memory maps of the rows and their scales
+        with self.lock:
+            self.refresh()
+            if self.mmap is None and self.ids:
+                self.mmap = np.memmap(self.vectors_file, dtype=self.dtype(), mode='r', shape=(len(self.ids), self.vector_size))
+                if self.format == 'int8':
+                    self.scales = np.memmap(self.scales_file, dtype=np.float32, mode='r', shape=(len(self.ids), 1))
+            return self.mmap, self.scales
+
+    def array(self) -> np.ndarray:
+        # The memory mapped rows as stored (quantized, for float16 and int8)
+        mmap, _ = self.load()
+        if mmap is None:
+            return np.zeros((0, self.vector_size or 0), dtype=self.dtype())
+        return mmap
+
+    def vectors(self, rows) -> np.ndarray:
+        # Full precision (float32) vectors of the given rows - a slice or an array of row numbers
+        mmap, scales = self.load()
+        if mmap is None:
+            return np.zeros((0, self.vector_size or 0), dtype=np.float32)
+        return dequantize(np.asarray(mmap[rows]), None if scales is None else np.asarray(scales[rows]))
+
+    def get(self, id: str) -> Embedding:
+        self.refresh()
+        row = self.rows.get(id)
+        if row is None:
+            return None
+        return self.vectors(slice(row, row + 1))[0]
+
+    def set(self, id: str, embedding: Embedding, version: str = None) -> None:
+        self.set_many([id], [embedding], None if version is None else [version])
+
+    def set_many(self, ids: list[str], embeddings: list[Embedding], versions: list[str] = None) -> None:
+        vectors = np.stack([np.asarray(embedding, dtype=np.float32).reshape(-1) for embedding in embeddings])
+        with self.locked():
+            if self.vector_size is None:
+                # Possibly created by another process in the meantime
+                self.read_meta()
+            if self.vector_size is None:
+                self.vector_size = vectors.shape[1]
+                self.meta_file.write_text(json.dumps(dict(vector_size=self.vector_size, format=self.format)))
+            assert vectors.shape[1] == self.vector_size, f'Expected vectors of size {self.vector_size}, got {vectors.shape[1]}'
+            codes, scales = quantize(vectors, self.format)
+            self.refresh()
+            new = dict()
+            for i, id in enumerate(ids):
+                row = self.rows.get(id)
+                if row is not None:
+                    # Existing rows are overwritten in place
+                    if scales is not None:
+                        self.write_rows(self.scales_file, row, scales[i:i+1])
+                    self.write_rows(self.vectors_file, row, codes[i:i+1])
+                else:
+                    assert '\n' not in id
+                    new[id] = i
+            if new:
+                # New rows are appended together, followed by their ids
+                idx = list(new.values())
+                row = len(self.ids)
+                if scales is not None:
+                    self.write_rows(self.scales_file, row, scales[idx])
+                self.write_rows(self.vectors_file, row, codes[idx])
+                content = ''.join(id + '\n' for id in new).encode('utf-8')
+                with self.ids_file.open('ab') as file:
+                    file.write(content)
+                self.ids_size += len(content)
+                for id in new:
+                    self.rows[id] = len(self.ids)
+                    self.ids.append(id)
+                self.mmap = None
+                self.scales = None
+            if versions is not None:
+                # Written after the rows, so a version is never recorded for data that isn't there
+                content = ''.join(f'{id}\t{version}\n' for id, version in zip(ids, versions)).encode('utf-8')
+                with self.versions_file.open('ab') as file:
+                    file.write(content)
+                self.versions_size += len(content)
+                self.versions.update(zip(ids, versions))
+
+    def write_rows(self, filename: Path, row: int, rows: np.ndarray) -> None:
+        with filename.open('r+b' if filename.exists() else 'wb') as file:
+            file.seek(row * rows[0].nbytes)
+            file.write(rows.tobytes())
+
+    def items(self, chunk_size=4096) -> Iterator[tuple[list[str], np.ndarray]]:
+        # Sequential scan, in chunks of ids and their vectors
+        self.refresh()
+        ids = list(self.ids)
+        for i in range(0, len(ids), chunk_size):
+            yield ids[i:i+chunk_size], self.vectors(slice(i, i + chunk_size))
+
+
+class EmbeddingMatrices:
+
+    # One EmbeddingMatrix per catalog, under a root directory
+
+    def __init__(self, root: Path, format: str = 'float32') -> None:
+        self.root = root
+        self.format = format
+        self.matrices = dict()
+
+    def dirname(self, catalogId: str) -> str:
+        return re.sub(r'[^\w.-]', '_', catalogId)
+
+    def get(self, catalogId: str) -> EmbeddingMatrix:
+        dirname = self.dirname(catalogId)
+        if dirname not in self.matrices:
+            self.matrices[dirname] = EmbeddingMatrix(self.root / dirname, self.format)
+        return self.matrices[dirname]
+
+    def catalogs(self) -> list[EmbeddingMatrix]:
+        if not self.root.exists():
+            return []
+        return [self.get(path.name) for path in sorted(self.root.iterdir()) if (path / 'meta.json').exists()]
+
+    def items(self, catalogId: str = None, chunk_size=4096) -> Iterator[tuple[list[str], np.ndarray]]:
+        matrices = [self.get(catalogId)] if catalogId else self.catalogs()
+        for matrix in matrices:
+            yield from matrix.items(chunk_size)
@@ -2,18 +2,22 @@ from pathlib import Path
 import os
 import hashlib
 import json
-import numpy as np
 import dataclasses
 
 from ..store import Store
-from ...config import CACHE_DIR
+from ..embedding_matrix import EmbeddingMatrices
+from ...config import config, CACHE_DIR
 from ...datatypes import Dataset, Embedding, Resource, Field
+from ...quantization import decode_embedding
 from ....common.realtime_status import realtime_status as rts
 
 DIR = CACHE_DIR / '.fsstore'
 
 class FSStore(Store):
 
+    def __init__(self) -> None:
+        self.matrices = EmbeddingMatrices(DIR / 'embedding-matrix', config.embedding_storage_format or 'float32')
+
     async def storeDataset(self, dataset: Dataset, ctx: str) -> None:
         id = dataset.storeId()
         filename = self.get_filename('dataset', id, 'json')
@@ -28,13 +32,32 @@ class FSStore(Store):
         os.rename(dbFile, filename)
 
     async def storeEmbedding(self, dataset: Dataset, embedding: Embedding, ctx: str) -> None:
-        id = dataset.storeId()
-        filename = self.get_filename('embedding', id, 'npy')
-        rts.set(ctx, f'STORING EMBEDDING -> {filename}')
-        np.save(filename, embedding)
+        matrix = self.matrices.get(dataset.catalogId)
+        rts.set(ctx, f'STORING EMBEDDING -> {matrix.path}')
+        matrix.set(dataset.storeId(), embedding)
         
     async def getDataset(self, datasetId: str) -> Dataset:
         filename = self.get_filename('dataset', datasetId, 'json')
+        return self.load_dataset(filename)
+
+    async def fetchDataset(self, datasetId: str, version: str = None) -> tuple[Dataset, str]:
+        filename = self.get_filename('dataset', datasetId, 'json')
+        try:
+            stat = filename.stat()
+        except FileNotFoundError:
+            return None, None
+        current = f'{stat.st_mtime_ns}-{stat.st_size}'
+        if current == version:
+            return None, version
+        return self.load_dataset(filename), current
+
+    async def iterDatasets(self, catalogId: str = None):
+        for filename in sorted((DIR / 'dataset').glob('*/*/*.json')):
+            dataset = self.load_dataset(filename)
+            if dataset is not None and (catalogId is None or dataset.catalogId == catalogId):
+                yield dataset
+
+    def load_dataset(self, filename: Path) -> Dataset:
         if filename.exists():
             with open(filename) as file:
                 data = json.load(file)
@@ -60,10 +83,19 @@ class FSStore(Store):
     
     async def getEmbedding(self, dataset: Dataset) -> Embedding:
         id = dataset.storeId()
-        filename = self.get_filename('embedding', id, 'npy')
-        if filename.exists():
-            return np.load(filename)
-        return None
+        matrix = self.matrices.get(dataset.catalogId)
+        embedding = matrix.get(id)
+        if embedding is None:
+            # Embeddings stored as separate files before the consolidated matrix
+            filename = self.get_filename('embedding', id, 'npy')
+            if filename.exists():
+                embedding = decode_embedding(filename.read_bytes())
+                matrix.set(id, embedding)
+        return embedding
+
+    async def iterEmbeddings(self, catalogId: str = None):
+        for ids, vectors in self.matrices.items(catalogId):
+            yield ids, vectors
 
     async def findDatasets(self, embedding: Embedding) -> list[Dataset]:
         return []
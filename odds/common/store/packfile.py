@@ -0,0 +1,65 @@
+from typing import Iterable, Iterator
+import json
+import struct
+import zlib
+
+
+# A packfile is a sequence of zlib compressed records, followed by a compressed JSON index
+# mapping each record's key to its (offset, length, etag), and a fixed size trailer holding the
+# index's offset and length. Readers can fetch the trailer and index alone (e.g. with range
+# requests) and then any single record, or the whole file in one sequential read.
+
+MAGIC = b'ODDSPAK1'
+TRAILER = struct.Struct('<QQ8s')
+
+
+def build_packfile(records: Iterable[tuple[str, str, bytes]]) -> bytes:
+    # Records are (key, etag, content)
+    parts = []
+    index = dict()
+    offset = 0
+    for key, etag, content in records:
+        blob = zlib.compress(content)
+        index[key] = (offset, len(blob), etag)
+        parts.append(blob)
+        offset += len(blob)
+    encoded_index = zlib.compress(json.dumps(index).encode('utf-8'))
+    parts.append(encoded_index)
+    parts.append(TRAILER.pack(offset, len(encoded_index), MAGIC))
+    return b''.join(parts)
+
+
+def parse_trailer(data: bytes) -> tuple[int, int]:
+    # The offset and length of the index
+    if len(data) < TRAILER.size:
+        raise ValueError('truncated packfile')
+    offset, length, magic = TRAILER.unpack(data[-TRAILER.size:])
+    if magic != MAGIC:
+        raise ValueError('not a packfile')
+    return offset, length
+
+
+def parse_index(data: bytes) -> dict[str, tuple[int, int, str]]:
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class Packfile:
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        offset, length = parse_trailer(data)
+        self.index = parse_index(data[offset:offset + length])
+
+    def etag(self, key: str) -> str:
+        return self.index[key][2]
+
+    def get(self, key: str) -> bytes:
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        offset, length, _ = entry
+        return zlib.decompress(self.data[offset:offset + length])
+
+    def items(self) -> Iterator[tuple[str, str, bytes]]:
+        for key, (_, _, etag) in self.index.items():
+            yield key, etag, self.get(key)
@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Awaitable, Callable
+import asyncio
+import fcntl
+import json
+import os
+import time
+import uuid
+
+
+# Downloads `key` into the given file, returning (written, etag): (True, etag) when downloaded,
+# (False, etag) when the object still matches the etag passed in, and (False, None) when it's missing
+Downloader = Callable[[str, str, Path], Awaitable[tuple[bool, str]]]
+
+
+class DBCache:
+
+    # Local copies of remote sqlite files, kept within a byte budget by evicting the least
+    # recently used ones. The directory may be shared by several worker processes, so it is the
+    # source of truth: sizes come from the files themselves and each use touches the file's mtime.
+    # A shared manifest, only modified under a file lock, records the ETag each file was downloaded
+    # at; files older than `ttl` seconds (or missing from the manifest) are revalidated before use.
+    # Downloads go to a temporary file which is renamed into place, and a per-key lock makes
+    # concurrent requests for the same file share a single download.
+
+    MANIFEST = 'manifest.json'
+    LOCKFILE = 'manifest.lock'
+    # Files used this recently may be about to be opened, by this or another process
+    EVICT_GRACE = 60
+    # Temporary files this old were left behind by a crashed download
+    TMP_MAX_AGE = 3600
+
+    def __init__(self, dir: Path, max_bytes: int, ttl=3600) -> None:
+        self.dir = dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.loop = None
+        self.locks = dict()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.sweep()
+
+    def filename(self, key: str) -> Path:
+        return self.dir / f"{key.replace('/', '_')}.sqlite"
+
+    def sweep(self) -> None:
+        now = time.time()
+        for tmp in self.dir.glob('*.tmp'):
+            try:
+                if now - tmp.stat().st_mtime > self.TMP_MAX_AGE:
+                    tmp.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def locked_manifest(self):
+        # Read-modify-write of the manifest, exclusive across processes
+        with open(self.dir / self.LOCKFILE, 'a') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                manifest = self.read_manifest()
+                yield manifest
+                tmp = self.dir / f'{self.MANIFEST}.{uuid.uuid4().hex}.tmp'
+                tmp.write_text(json.dumps(manifest))
+                os.replace(tmp, self.dir / self.MANIFEST)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def read_manifest(self) -> dict:
+        try:
+            return json.loads((self.dir / self.MANIFEST).read_text())
+        except Exception:
+            return dict()
+
+    def lock(self, key: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.locks = dict()
+        if key not in self.locks:
+            self.locks[key] = asyncio.Lock()
+        return self.locks[key]
+
+    def busy(self) -> set[Path]:
+        # Files being downloaded or revalidated - taken on the event loop, which owns the locks
+        return set(self.filename(key) for key, lock in self.locks.items() if lock.locked())
+
+    def record(self, key: str, etag: str, checked: float) -> None:
+        # Records the ETag a file was downloaded (or revalidated) at, or removes a missing file
+        with self.locked_manifest() as manifest:
+            if etag is None:
+                manifest.pop(key, None)
+                self.filename(key).unlink(missing_ok=True)
+            else:
+                manifest[key] = dict(etag=etag, checked=checked)
+
+    def evict(self, busy: set[Path]) -> None:
+        files = []
+        for filename in self.dir.glob('*.sqlite'):
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_bytes:
+            return
+        now = time.time()
+        with self.locked_manifest() as manifest:
+            names = dict((self.filename(key).name, key) for key in manifest)
+            for used, size, filename in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if now - used < self.EVICT_GRACE or filename in busy:
+                    continue
+                # Readers which already opened the file keep their handle
+                filename.unlink(missing_ok=True)
+                manifest.pop(names.get(filename.name), None)
+                total -= size
+
+    async def get(self, key: str, download: Downloader) -> str:
+        async with self.lock(key):
+            filename = self.filename(key)
+            entry = (await asyncio.to_thread(self.read_manifest)).get(key) if filename.exists() else None
+            now = time.time()
+            if entry is not None and now - entry['checked'] < self.ttl:
+                os.utime(filename)
+                return str(filename)
+
+            tmp = filename.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+            try:
+                written, etag = await download(key, entry['etag'] if entry else None, tmp)
+                if written:
+                    os.replace(tmp, filename)
+            except Exception as e:
+                print('FAILED TO DOWNLOAD', key, e)
+                return str(filename) if entry is not None else None
+            finally:
+                tmp.unlink(missing_ok=True)
+
+            # The manifest lock may be held by another process for a whole eviction
+            await asyncio.to_thread(self.record, key, etag, now)
+            if etag is None:
+                return None
+            os.utime(filename)
+            await asyncio.to_thread(self.evict, self.busy())
+            return str(filename)
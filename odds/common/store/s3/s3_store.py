@@ -1,35 +1,86 @@
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, AsyncExitStack
+import asyncio
 import hashlib
 import json
-import numpy as np
 import dataclasses
-from io import BytesIO
+import time
+from pathlib import Path
 
 import aioboto3
+import numpy as np
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 from ...config import config, CACHE_DIR
 from ..store import Store
+from .db_cache import DBCache
+from ..packfile import Packfile, build_packfile, parse_index, parse_trailer, TRAILER
+from ..embedding_matrix import EmbeddingMatrices
 from ...datatypes import Dataset, Embedding, Resource, Field
+from ...quantization import encode_embedding, decode_embedding
 from ...realtime_status import realtime_status as rts
 
 
+PACKFILE_PREFIX = 'packfile/'
+PACKFILE_SUFFIX = '.pack'
+# Embeddings are packed per catalog too, keyed by dataset store id
+EMBEDDING_PACKFILE_PREFIX = 'embedding-packfile/'
+
+
 class S3Store(Store):
 
     def __init__(self) -> None:
         self.session = aioboto3.Session()
-        self.cachedir = CACHE_DIR / 's3-temp'
-        self.cachedir.mkdir(exist_ok=True, parents=True)
+        self.loop = None
+        self.lock = None
+        self.stack = None
+        self.shared_bucket = None
+        self.db_cache = DBCache(CACHE_DIR / 's3-temp', config.s3_db_cache_max_bytes or 10 * 1024**3, config.s3_db_cache_ttl or 3600)
+        # Local consolidated copy of the embeddings, for fast lookups and sequential scans
+        self.matrices = EmbeddingMatrices(CACHE_DIR / 's3-embeddings', config.embedding_storage_format or 'float32')
+        # Keys of the packed datasets, from the packfile indexes, to answer hasDataset without a request per dataset
+        self.packed = None
+        self.packed_at = 0
+        self.packed_lock = None
+
+    async def connect(self):
+        # A single client (and connection pool) is shared by all calls. Clients are bound to
+        # the event loop which created them, so a new one is created when the loop changes.
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.lock = asyncio.Lock()
+            self.packed_lock = asyncio.Lock()
+            self.stack = None
+            self.shared_bucket = None
+        async with self.lock:
+            if self.shared_bucket is None:
+                stack = AsyncExitStack()
+                s3 = await stack.enter_async_context(self.session.resource(
+                    's3',
+                    aws_access_key_id=config.credentials.s3_store.access_key_id,
+                    aws_secret_access_key=config.credentials.s3_store.secret_access_key,
+                    region_name=config.credentials.s3_store.region,
+                    endpoint_url=config.credentials.s3_store.endpoint_url,
+                    config=Config(
+                        max_pool_connections=config.s3_max_pool_connections or 64,
+                        tcp_keepalive=True,
+                    ),
+                ))
+                self.shared_bucket = await s3.Bucket(config.credentials.s3_store.bucket)
+                self.stack = stack
+        return self.shared_bucket
 
     @asynccontextmanager
     async def bucket(self):
-        async with self.session.resource(
-            's3',
-            aws_access_key_id=config.credentials.s3_store.access_key_id,
-            aws_secret_access_key=config.credentials.s3_store.secret_access_key,
-            region_name=config.credentials.s3_store.region,
-            endpoint_url=config.credentials.s3_store.endpoint_url,
-        ) as s3:
-            yield await s3.Bucket(config.credentials.s3_store.bucket)
+        yield await self.connect()
+
+    async def close(self) -> None:
+        if self.stack is not None and self.loop is asyncio.get_running_loop():
+            stack = self.stack
+            self.stack = None
+            self.shared_bucket = None
+            await stack.aclose()
 
     async def storeDataset(self, dataset: Dataset, ctx: str) -> None:
         async with self.bucket() as bucket:
@@ -52,77 +103,325 @@ class S3Store(Store):
             id = dataset.storeId()
             key = self.get_key('embedding', id, 'npy')
             rts.set(ctx, f'STORING EMBEDDING -> {key}')
-            filename = BytesIO()
-            np.save(filename, embedding)
-            filename.seek(0)
-            obj = await bucket.Object(key)
-            await obj.upload_fileobj(filename)
+            content = encode_embedding(embedding, config.embedding_storage_format or 'float32')
+            response = await bucket.meta.client.put_object(Bucket=bucket.name, Key=key, Body=content)
+        self.matrices.get(dataset.catalogId).set(id, embedding, response.get('ETag'))
         
     async def getDataset(self, datasetId: str) -> Dataset:
-        async with self.bucket() as bucket:
-            key = self.get_key('dataset', datasetId, 'json')
+        key = self.get_key('dataset', datasetId, 'json')
+        return await self.load_dataset(key)
+
+    async def fetchDataset(self, datasetId: str, version: str = None) -> tuple[Dataset, str]:
+        key = self.get_key('dataset', datasetId, 'json')
+        content, etag = await self.fetch_object(key, etag=version)
+        if content is None:
+            return None, etag
+        dataset = self.parse_dataset(key, content)
+        return dataset, etag if dataset is not None else None
+
+    async def iterDatasets(self, catalogId: str = None):
+        async for key, _, content, _ in self.iter_dataset_records([catalogId] if catalogId else None):
+            dataset = self.parse_dataset(key, content)
+            if dataset is not None:
+                yield dataset
+
+    async def iter_dataset_records(self, catalogIds: list[str] = None, unpacked: bool = False):
+        # Yields (key, etag, content, catalogId) of all stored datasets (of the given catalogs, if specified).
+        # Records are taken from the catalog packfiles when they're up to date with the dataset objects,
+        # anything else is fetched concurrently in chunks. With `unpacked`, the fetched datasets of
+        # catalogs which don't have a packfile yet are yielded too, so they can be packed.
+        catalogIds = set(catalogIds) if catalogIds is not None else None
+        objects = await self.list_objects('dataset/')
+        remaining = dict(objects)
+        pack_catalogs = set()
+        for pack_key in await self.list_objects(PACKFILE_PREFIX):
+            pack_catalog = pack_key[len(PACKFILE_PREFIX):-len(PACKFILE_SUFFIX)]
+            pack_catalogs.add(pack_catalog)
             try:
-                obj = await bucket.Object(key)
-                await obj.load()
+                if catalogIds is None or pack_catalog in catalogIds:
+                    content, _ = await self.fetch_object(pack_key)
+                    pack = Packfile(content)
+                    for key, etag, record in pack.items():
+                        if objects.get(key) == etag:
+                            del remaining[key]
+                            yield key, etag, record, pack_catalog
+                else:
+                    # Only the index is needed to skip datasets of other catalogs
+                    for key in await self.fetch_packfile_index(pack_key):
+                        remaining.pop(key, None)
             except Exception as e:
-                return None
+                print('FAILED TO READ PACKFILE', pack_key, e)
+
+        async for key, content, etag in self.fetch_objects(list(remaining)):
+            if content is None:
+                continue
             try:
-                content = await obj.get()
-                content = await content['Body'].read()
-                data = json.loads(content.decode('utf-8'))
-                resources = data.pop('resources', [])
-                for resource in resources:
-                    resource['fields'] = [Field(**f) for f in resource['fields']]
-                data['resources'] = [Resource(**r) for r in resources]
-                if 'embedding' in data:
-                    data['status_embedding'] = bool(data.pop('embedding'))
-                dataset = Dataset(**data)
-                return dataset
-            except Exception as e:
-                print('FAILED TO LOAD', key, e)
-                return None
+                record_catalog = json.loads(content)['catalogId']
+            except Exception:
+                record_catalog = None
+            if catalogIds is None or record_catalog in catalogIds or (unpacked and record_catalog not in pack_catalogs):
+                yield key, etag, content, record_catalog
+
+    async def fetch_objects(self, keys: list[str]):
+        # Yields (key, content, etag) of each key, fetched concurrently in chunks
+        concurrency = config.store_read_concurrency or 32
+        sem = asyncio.Semaphore(concurrency)
+        async def load(key):
+            async with sem:
+                return await self.fetch_object(key)
+        for i in range(0, len(keys), concurrency * 8):
+            chunk = keys[i:i + concurrency * 8]
+            records = await asyncio.gather(*[load(key) for key in chunk])
+            for key, (content, etag) in zip(chunk, records):
+                yield key, content, etag
+
+    async def buildPackfiles(self, catalogIds: list[str]) -> None:
+        # All the catalogs are packed in a single pass over the stored datasets, followed by their
+        # embeddings (against a single listing of the stored ones). Catalogs which weren't packed yet
+        # are packed along, so their datasets aren't fetched one by one again on the next pass.
+        if not catalogIds:
+            return
+        records = dict((catalogId, []) for catalogId in catalogIds)
+        async for key, etag, content, catalogId in self.iter_dataset_records(catalogIds, unpacked=True):
+            if catalogId is not None:
+                records.setdefault(catalogId, []).append((key, etag, content))
+        bucket = await self.connect()
+        for catalogId, catalog_records in records.items():
+            key = f'{PACKFILE_PREFIX}{catalogId}{PACKFILE_SUFFIX}'
+            rts.set('packfile', f'STORING PACKFILE {catalogId} ({len(catalog_records)} DATASETS) -> {key}')
+            await bucket.meta.client.put_object(Bucket=bucket.name, Key=key, Body=build_packfile(catalog_records))
+        self.packed = None
+        etags = await self.list_objects('embedding/')
+        for catalogId, catalog_records in records.items():
+            ids = []
+            for key, _, content in catalog_records:
+                try:
+                    ids.append(f'{catalogId}/{json.loads(content)["id"]}')
+                except Exception:
+                    pass
+            key = f'{EMBEDDING_PACKFILE_PREFIX}{catalogId}{PACKFILE_SUFFIX}'
+            embedding_records = await self.embedding_records(key, ids, etags)
+            rts.set('packfile', f'STORING EMBEDDING PACKFILE {catalogId} ({len(embedding_records)} EMBEDDINGS) -> {key}')
+            await bucket.meta.client.put_object(Bucket=bucket.name, Key=key, Body=build_packfile(embedding_records))
+        rts.clear('packfile')
+
+    async def embedding_records(self, pack_key: str, ids: list[str], etags: dict[str, str]) -> list[tuple[str, str, bytes]]:
+        # (id, etag, content) of the stored embeddings of these datasets: taken from the previous
+        # packfile when still current, fetched otherwise
+        previous = None
+        try:
+            content, _ = await self.fetch_object(pack_key)
+            if content is not None:
+                previous = Packfile(content)
+        except Exception as e:
+            print('FAILED TO READ PACKFILE', pack_key, e)
+        records = []
+        missing = dict()
+        for id in ids:
+            key = self.get_key('embedding', id, 'npy')
+            etag = etags.get(key)
+            if etag is None:
+                continue
+            if previous is not None and id in previous.index and previous.etag(id) == etag:
+                records.append((id, etag, previous.get(id)))
+            else:
+                missing[key] = id
+        async for key, content, etag in self.fetch_objects(list(missing)):
+            if content is not None:
+                records.append((missing[key], etag, content))
+        return records
+
+    async def list_objects(self, prefix: str) -> dict[str, str]:
+        # Keys under the prefix and their ETags
+        bucket = await self.connect()
+        paginator = bucket.meta.client.get_paginator('list_objects_v2')
+        objects = dict()
+        async for page in paginator.paginate(Bucket=bucket.name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                objects[obj['Key']] = obj['ETag']
+        return objects
+
+    async def packed_keys(self) -> set[str]:
+        # Union of all packfile indexes, reloaded when older than the TTL or after packing
+        await self.connect()
+        async with self.packed_lock:
+            ttl = config.s3_packfile_index_ttl or 600
+            if self.packed is None or time.time() - self.packed_at > ttl:
+                pack_keys = list(await self.list_objects(PACKFILE_PREFIX))
+                indexes = await asyncio.gather(*[self.fetch_packfile_index(key) for key in pack_keys], return_exceptions=True)
+                packed = set()
+                for pack_key, index in zip(pack_keys, indexes):
+                    if isinstance(index, Exception):
+                        print('FAILED TO READ PACKFILE INDEX', pack_key, index)
+                        continue
+                    packed.update(index)
+                self.packed = packed
+                self.packed_at = time.time()
+            return self.packed
+
+    async def fetch_packfile_index(self, key: str) -> dict:
+        trailer, _ = await self.fetch_object(key, range=f'bytes=-{TRAILER.size}')
+        if trailer is None:
+            return dict()
+        offset, length = parse_trailer(trailer)
+        content, _ = await self.fetch_object(key, range=f'bytes={offset}-{offset + length - 1}')
+        return parse_index(content)
+
+    async def fetch_object(self, key: str, etag: str = None, range: str = None) -> tuple[bytes, str]:
+        # A single GET, returning the content and its ETag.
+        # A missing object returns (None, None); an object still matching `etag` returns (None, etag).
+        # `range` is an HTTP byte range, e.g. 'bytes=0-1023'.
+        response = await self.get_object(key, etag, range)
+        if response is None:
+            return None, None
+        if response.get('NotModified'):
+            return None, etag
+        body = response['Body']
+        async with body:
+            return await body.read(), response.get('ETag')
+
+    async def get_object(self, key: str, etag: str = None, range: str = None) -> dict:
+        bucket = await self.connect()
+        params = dict(Bucket=bucket.name, Key=key)
+        if etag:
+            params['IfNoneMatch'] = etag
+        if range:
+            params['Range'] = range
+        try:
+            return await bucket.meta.client.get_object(**params)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('304', 'NotModified'):
+                return dict(NotModified=True)
+            if code not in ('NoSuchKey', '404'):
+                print('FAILED TO FETCH', key, e)
+            return None
+
+    async def load_dataset(self, key: str) -> Dataset:
+        content, _ = await self.fetch_object(key)
+        if content is None:
+            return None
+        return self.parse_dataset(key, content)
+
+    def parse_dataset(self, key: str, content: bytes) -> Dataset:
+        try:
+            data = json.loads(content.decode('utf-8'))
+            resources = data.pop('resources', [])
+            for resource in resources:
+                resource['fields'] = [Field(**f) for f in resource['fields']]
+            data['resources'] = [Resource(**r) for r in resources]
+            if 'embedding' in data:
+                data['status_embedding'] = bool(data.pop('embedding'))
+            dataset = Dataset(**data)
+            return dataset
+        except Exception as e:
+            print('FAILED TO LOAD', key, e)
+            return None
     
     async def hasDataset(self, datasetId: str) -> bool:
-        async with self.bucket() as bucket:
-            key = self.get_key('dataset', datasetId, 'json')
-            obj = await bucket.Object(key)
-            try:
-                await obj.load()
-                return True
-            except:
-                return False
+        # Packed datasets are known from the packfile indexes, only others need a HEAD request
+        key = self.get_key('dataset', datasetId, 'json')
+        if key in await self.packed_keys():
+            return True
+        bucket = await self.connect()
+        try:
+            await bucket.meta.client.head_object(Bucket=bucket.name, Key=key)
+            return True
+        except ClientError:
+            return False
     
     async def getDB(self, resource: Resource, dataset: Dataset) -> str:
-        async with self.bucket() as bucket:
-            id = '{}/{}'.format(dataset.storeId(), resource.url)
-            key = self.get_key('db', id, 'sqlite')
-            print('GETTING DB', dataset.catalogId, dataset.id, resource.title, key)
-            try:
-                obj = await bucket.Object(key)
-                await obj.load()
-                # download the file into a temporary file:
-                key = key.replace('/', '_')
-                outfile = self.cachedir / f'{key}.sqlite'
-                if not outfile.exists():
-                    await obj.download_file(str(outfile))
-                return str(outfile)
-            except Exception as e:
-                pass
-        return None
+        id = '{}/{}'.format(dataset.storeId(), resource.url)
+        key = self.get_key('db', id, 'sqlite')
+        print('GETTING DB', dataset.catalogId, dataset.id, resource.title, key)
+        return await self.db_cache.get(key, self.download_db)
+
+    async def download_db(self, key: str, etag: str, filename: Path) -> tuple[bool, str]:
+        response = await self.get_object(key, etag)
+        if response is None:
+            return False, None
+        if response.get('NotModified'):
+            return False, etag
+        body = response['Body']
+        async with body:
+            with open(filename, 'wb') as f:
+                async for chunk in body.iter_chunks(1024 * 1024):
+                    f.write(chunk)
+        return True, response.get('ETag')
     
     async def getEmbedding(self, dataset: Dataset) -> Embedding:
-        async with self.bucket() as bucket:
-            id = dataset.storeId()
-            key = self.get_key('embedding', id, 'npy')
+        # The local mirror is only used while it's at the stored embedding's ETag
+        id = dataset.storeId()
+        matrix = self.matrices.get(dataset.catalogId)
+        version = matrix.version(id)
+        content, etag = await self.fetch_object(self.get_key('embedding', id, 'npy'), etag=version)
+        if content is None:
+            # Not modified, or S3 missed
+            return matrix.get(id)
+        embedding = self.decode_embedding(id, content)
+        if embedding is not None:
+            matrix.set(id, embedding, etag)
+        return embedding
+
+    async def iterEmbeddings(self, catalogId: str = None):
+        # Embeddings are read from the catalog packfiles (one GET per catalog), and copied to the local mirror.
+        # A single catalog's packfile is used as is, since it's rebuilt after each scan of the catalog.
+        # Reading all catalogs revalidates them against a single listing of the stored embeddings:
+        # changed ones are fetched again, deleted ones are skipped.
+        if catalogId:
+            pack_keys = [f'{EMBEDDING_PACKFILE_PREFIX}{catalogId}{PACKFILE_SUFFIX}']
+            etags = None
+        else:
+            pack_keys = list(await self.list_objects(EMBEDDING_PACKFILE_PREFIX))
+            etags = await self.list_objects('embedding/')
+        for pack_key in pack_keys:
+            pack_catalog = pack_key[len(EMBEDDING_PACKFILE_PREFIX):-len(PACKFILE_SUFFIX)]
             try:
-                obj = await bucket.Object(key)
-                await obj.load()
-                content = await obj.get()
-                content = await content['Body'].read()
-                filename = BytesIO(content)
-                return np.load(filename)
-            except:
-                pass
+                content, _ = await self.fetch_object(pack_key)
+                pack = Packfile(content) if content is not None else None
+            except Exception as e:
+                print('FAILED TO READ PACKFILE', pack_key, e)
+                pack = None
+            if pack is None:
+                continue
+            matrix = self.matrices.get(pack_catalog)
+            packed = list(pack.index)
+            for i in range(0, len(packed), 4096):
+                records = []
+                stale = dict()
+                for id in packed[i:i + 4096]:
+                    etag = pack.etag(id)
+                    if etags is not None:
+                        key = self.get_key('embedding', id, 'npy')
+                        if etags.get(key) is None:
+                            continue
+                        if etags[key] != etag:
+                            stale[key] = id
+                            continue
+                    records.append((id, etag, pack.get(id)))
+                async for key, content, etag in self.fetch_objects(list(stale)):
+                    if content is not None:
+                        records.append((stale[key], etag, content))
+                ids, embeddings, versions = [], [], []
+                for id, etag, content in records:
+                    embedding = self.decode_embedding(id, content)
+                    if embedding is not None:
+                        ids.append(id)
+                        embeddings.append(embedding)
+                        versions.append(etag)
+                if not ids:
+                    continue
+                matrix.refresh()
+                update = [j for j, id in enumerate(ids) if matrix.versions.get(id) != versions[j]]
+                if update:
+                    matrix.set_many([ids[j] for j in update], [embeddings[j] for j in update], [versions[j] for j in update])
+                yield ids, np.stack([np.asarray(embedding, dtype=np.float32).reshape(-1) for embedding in embeddings])
+
+    def decode_embedding(self, id: str, content: bytes) -> Embedding:
+        try:
+            return decode_embedding(content)
+        except Exception as e:
+            print('FAILED TO DECODE EMBEDDING', id, e)
             return None
 
     async def findDatasets(self, embedding: Embedding) -> list[Dataset]:
@@ -1,3 +1,6 @@
+from typing import AsyncIterator
+import numpy as np
+
 from ..datatypes import Dataset, Embedding, Resource
 
 class Store:
@@ -14,6 +17,11 @@ class Store:
     async def getDataset(self, datasetId: str) -> Dataset:
         return None
     
+    async def fetchDataset(self, datasetId: str, version: str = None) -> tuple[Dataset, str]:
+        # A dataset along with an opaque version (e.g. an ETag), for revalidating cached copies.
+        # Returns (None, version) if the dataset is still at `version`, and (None, None) if it's missing.
+        return await self.getDataset(datasetId), None
+
     async def getDB(self, resource: Resource, dataset: Dataset) -> str:
         return None
 
@@ -21,4 +29,22 @@ class Store:
         return None
     
     async def hasDataset(self, datasetId: str) -> bool:
-        return False
\ No newline at end of file
+        return False
+
+    async def iterDatasets(self, catalogId: str = None) -> AsyncIterator[Dataset]:
+        # All stored datasets (of a single catalog, if specified), in no particular order
+        return
+        yield
+
+    async def iterEmbeddings(self, catalogId: str = None) -> AsyncIterator[tuple[list[str], np.ndarray]]:
+        # Chunks of dataset store ids and their embeddings (one per row)
+        return
+        yield
+
+    async def buildPackfiles(self, catalogIds: list[str]) -> None:
+        # Rebuilds the compacted copies of these catalogs' datasets and embeddings, for fast bulk reads
+        pass
+
+    async def close(self) -> None:
+        # Releases any connections held by the store
+        pass
@@ -1,6 +1,13 @@
 from .indexer import Indexer
 from ..select import select
+from ..config import config
 from ..embedder import embedder
 from .chromadb.chromadb_indexer import ChromaDBIndexer
+from .numpy.numpy_indexer import NumpyIndexer
+from .milvus.milvus_indexer import MilvusIndexer
+from .ivfpq.ivfpq_indexer import IVFPQIndexer
+from .lexical_index import LexicalIndex
 
-indexer: Indexer = select('Indexer', locals())(embedder.vector_size())
\ No newline at end of file
+indexer: Indexer = select('Indexer', locals())(embedder.vector_size())
+
+lexical_index: LexicalIndex = None if config.disable_lexical_index else LexicalIndex()
\ No newline at end of file
@@ -1,34 +1,128 @@
+import asyncio
 import chromadb
 import httpx
 from pathlib import Path
 import os
+import time
 
+from ..indexer import Indexer
+from ..search_filter import SearchFilter, dataset_metadata
+from ...batcher import MicroBatcher
 from ...config import config, CACHE_DIR
 from ...datatypes import Embedding, Dataset
 
 DIRNAME = CACHE_DIR / '.chromadb'
 os.makedirs(DIRNAME, exist_ok=True)
+# Name of the collection in use, switched when a rebuilt index is promoted
+ACTIVE_COLLECTION_FILE = DIRNAME / 'active_collection'
 
-class ChromaDBIndexer:
+class ChromaDBIndexer(Indexer):
 
     COLLECTION_NAME = 'datasets'
+    BATCH_SIZE = 256
 
-    def __init__(self, vector_size) -> None:
+    batcher: MicroBatcher = None
+
+    def __init__(self, vector_size, collection_name=None) -> None:
+        self.vector_size = vector_size
         self.client = chromadb.PersistentClient(path=str(DIRNAME))
-        self.collection = self.client.create_collection(
-            name=self.COLLECTION_NAME, get_or_create=True,
+        self.collection = self.open_collection(collection_name or self.active_collection())
+        self.batch_size = config.indexer_batch_size or self.BATCH_SIZE
+        self.lock = None
+
+    def active_collection(self) -> str:
+        if ACTIVE_COLLECTION_FILE.exists():
+            return ACTIVE_COLLECTION_FILE.read_text().strip()
+        return self.COLLECTION_NAME
+
+    def open_collection(self, name):
+        return self.client.create_collection(
+            name=name, get_or_create=True,
             metadata={'hnsw:space': 'cosine'}
         )
 
+    def fresh(self) -> 'ChromaDBIndexer':
+        return ChromaDBIndexer(self.vector_size, f'{self.COLLECTION_NAME}_{time.time_ns()}')
+
+    async def promote(self, fresh: 'ChromaDBIndexer') -> None:
+        old = self.collection.name
+        tmp = ACTIVE_COLLECTION_FILE.with_suffix('.tmp')
+        tmp.write_text(fresh.collection.name)
+        os.replace(tmp, ACTIVE_COLLECTION_FILE)
+        self.collection = fresh.collection
+        if old != fresh.collection.name:
+            await asyncio.to_thread(self.client.delete_collection, old)
+
     async def index(self, dataset: Dataset, embedding: Embedding) -> None:
-        self.collection.upsert(
-            embeddings=[embedding.tolist()],
-            ids=[dataset.storeId()]
-        )
-    
-    async def findDatasets(self, embedding: Embedding, num=10) -> list[str]:
-        ret = self.collection.query(
-            query_embeddings=[embedding.tolist()],
+        # Concurrent calls are buffered and upserted together
+        if not self.batcher:
+            self.batcher = MicroBatcher(self.index_many, max_items=self.batch_size, max_delay=config.indexer_batch_delay or 0.5)
+        await self.batcher.submit((dataset, embedding))
+
+    async def index_many(self, items: list[tuple[Dataset, Embedding]]) -> None:
+        if not self.lock:
+            self.lock = asyncio.Lock()
+        # Later items win if the same dataset appears twice
+        items = dict((dataset.storeId(), (dataset, embedding)) for dataset, embedding in items)
+        ids = list(items.keys())
+        async with self.lock:
+            for i in range(0, len(ids), self.batch_size):
+                chunk = ids[i:i+self.batch_size]
+                await asyncio.to_thread(
+                    self.collection.upsert,
+                    embeddings=[items[id][1].tolist() for id in chunk],
+                    metadatas=[dataset_metadata(items[id][0]) for id in chunk],
+                    ids=chunk
+                )
+
+    async def flush(self) -> None:
+        if self.batcher:
+            self.batcher.flush()
+            await asyncio.gather(*self.batcher.tasks)
+
+    async def findDatasets(self, embedding: Embedding, num=10, filter: SearchFilter = None) -> list[tuple[str, float]]:
+        return (await self.find_many([embedding], num, filter))[0]
+
+    async def find_many(self, embeddings: list[Embedding], num=10, filter: SearchFilter = None) -> list[list[tuple[str, float]]]:
+        if not embeddings:
+            return []
+        if self.collection.name != self.active_collection():
+            # Promoted by another process
+            self.collection = self.open_collection(self.active_collection())
+        query_embeddings = [embedding.tolist() for embedding in embeddings]
+        where = filter.chroma_where() if filter else None
+        ret = await asyncio.to_thread(
+            self.collection.query,
+            query_embeddings=query_embeddings,
             n_results=num,
+            where=where,
+            include=['distances'],
         )
-        return ret.get('ids')[0] if ret and ret.get('ids') else []
+        results = self.similarities(ret, len(embeddings))
+        if where is not None and filter.pass_unknown():
+            # Vectors indexed without metadata never match a where clause - when opted in (until a
+            # reindex backfills it), they're looked up separately and kept if the filter can't rule them out
+            unfiltered = await asyncio.to_thread(
+                self.collection.query,
+                query_embeddings=query_embeddings,
+                n_results=num,
+                include=['distances', 'metadatas'],
+            )
+            allowed = [
+                set(id for id, metadata in zip(ids, metadatas) if not metadata and filter.match(metadata, id))
+                for ids, metadatas in zip(unfiltered.get('ids') or [], unfiltered.get('metadatas') or [])
+            ]
+            for i, (matched, extra) in enumerate(zip(results, self.similarities(unfiltered, len(embeddings)))):
+                found = set(id for id, _ in matched)
+                extra = [(id, score) for id, score in extra if id in allowed[i] and id not in found]
+                results[i] = sorted(matched + extra, key=lambda item: -item[1])[:num]
+        return results
+
+    def similarities(self, ret: dict, count: int) -> list[list[tuple[str, float]]]:
+        if not ret or not ret.get('ids'):
+            return [[] for _ in range(count)]
+        # Cosine distances are converted to similarities
+        return [
+            [(id, 1 - distance) for id, distance in zip(ids, distances)]
+            for ids, distances in zip(ret['ids'], ret['distances'])
+        ]
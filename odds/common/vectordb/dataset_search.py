@@ -0,0 +1,21 @@
+from ..config import config
+from ..embedder import embedder
+from . import indexer, lexical_index
+from .fusion import comb_mnz, reciprocal_rank_fusion
+from .search_filter import SearchFilter
+
+
+async def find_datasets(terms: list[str], num=10, filter: SearchFilter = None) -> list[tuple[str, float]]:
+    # Hybrid search for datasets matching any of the terms, returning (dataset id, score) pairs.
+    # All terms are embedded and searched in a single call. Per-term results are fused by
+    # CombMNZ within the vector and the lexical (bm25) searches, and the two are fused by reciprocal rank.
+    terms = [term for term in terms if term and term.strip()]
+    if not terms:
+        return []
+    candidates = config.dataset_search_candidates or 2 * num
+    embeddings = await embedder.embed_many(terms)
+    results = await indexer.find_many([embedding for embedding in embeddings if embedding is not None], candidates, filter)
+    rankings = [comb_mnz(results)]
+    if lexical_index is not None:
+        rankings.append(comb_mnz(await lexical_index.search_many(terms, candidates, filter)))
+    return reciprocal_rank_fusion(rankings)[:num]
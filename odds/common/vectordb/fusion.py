@@ -0,0 +1,25 @@
+def reciprocal_rank_fusion(rankings: list[list[tuple[str, float]]], k=60, weights: list[float] = None) -> list[tuple[str, float]]:
+    # Fuses several ranked lists of (id, score), scoring each id by the sum of weight / (k + rank)
+    scores = dict()
+    for i, ranking in enumerate(rankings):
+        weight = weights[i] if weights else 1.0
+        for rank, (id, _) in enumerate(ranking):
+            scores[id] = scores.get(id, 0) + weight / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+def comb_mnz(results: list[list[tuple[str, float]]]) -> list[tuple[str, float]]:
+    # Fuses results of comparable searches (e.g. several query vectors against the same index):
+    # scores are min-max normalized per list, summed and multiplied by the number of lists an id appeared in
+    scores = dict()
+    hits = dict()
+    for result in results:
+        if not result:
+            continue
+        values = [score for _, score in result]
+        low, high = min(values), max(values)
+        for id, score in result:
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            scores[id] = scores.get(id, 0) + normalized
+            hits[id] = hits.get(id, 0) + 1
+    return sorted(((id, score * hits[id]) for id, score in scores.items()), key=lambda x: x[1], reverse=True)
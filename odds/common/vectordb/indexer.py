@@ -1,10 +1,31 @@
+import asyncio
+
 from ..datatypes import Embedding, Dataset
+from .search_filter import SearchFilter
 
 
 class Indexer:
 
     async def index(self, dataset: Dataset, embedding: Embedding) -> None:
         pass
-    
-    async def findDatasets(self, embedding: Embedding, num=10) -> list[str]:
-        return []
\ No newline at end of file
+
+    async def index_many(self, items: list[tuple[Dataset, Embedding]]) -> None:
+        for dataset, embedding in items:
+            await self.index(dataset, embedding)
+
+    async def flush(self) -> None:
+        pass
+
+    def fresh(self) -> 'Indexer':
+        # An empty index to bulk load and then swap in with promote() - by default, this index itself
+        return self
+
+    async def promote(self, fresh: 'Indexer') -> None:
+        pass
+
+    async def findDatasets(self, embedding: Embedding, num=10, filter: SearchFilter = None) -> list[tuple[str, float]]:
+        # (dataset id, similarity) pairs, most similar first
+        return []
+
+    async def find_many(self, embeddings: list[Embedding], num=10, filter: SearchFilter = None) -> list[list[tuple[str, float]]]:
+        return list(await asyncio.gather(*[self.findDatasets(embedding, num, filter) for embedding in embeddings]))
@@ -0,0 +1,369 @@
+import asyncio
+import atexit
+from array import array
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ..indexer import Indexer
+from ...batcher import MicroBatcher
+from ..search_filter import SearchFilter, dataset_metadata
+from ...config import config, CACHE_DIR
+from ...datatypes import Embedding, Dataset
+from ...quantization import top_k
+
+DIRNAME = CACHE_DIR / '.ivfpq-index'
+# Name of the subdirectory in use, switched when a rebuilt index is promoted
+CURRENT_FILE = DIRNAME / 'current'
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray, chunk_size=16384) -> np.ndarray:
+    # Index of the closest (L2) centroid for each vector
+    norms = (centroids ** 2).sum(axis=1)
+    ret = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        ret[start:start + chunk_size] = np.argmin(norms[None, :] - 2 * chunk @ centroids.T, axis=1)
+    return ret
+
+
+def grow(buffer: np.ndarray, size: int) -> np.ndarray:
+    # Buffers double in capacity, so appending rows one batch at a time stays linear
+    if len(buffer) >= size:
+        return buffer
+    grown = np.zeros((max(size, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations=15, seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = nearest(vectors, centroids)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        # Empty clusters are moved to random vectors
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+class IVFPQIndexer(Indexer):
+
+    # Approximate search for large indexes: vectors are assigned to the nearest of `nlist`
+    # coarse centroids (k-means), and their residuals are product quantized into `m` one byte
+    # codes. A query scans the vectors of its `nprobe` closest lists, scoring each one with
+    # lookup tables (asymmetric distance computation).
+    # Until there are enough vectors to train on, vectors are kept as they are and searched
+    # exactly. A fresh (rebuilt) index keeps them all until it's flushed, so training samples
+    # every catalog rather than the first ones to be reindexed. An index which has grown well
+    # past the vectors it was trained on warns that it should be rebuilt.
+    # Re-indexed ids are tombstoned and appended; the whole index is saved to a single
+    # npz file on flush and at exit.
+    # Rows live in buffers of growing capacity, of which only the first `size` are in use,
+    # and the inverted lists are extended in place as rows are added.
+
+    TRAIN_SIZE = 20000
+    SAMPLE_SIZE = 100000
+    # k-means needs a few dozen vectors per centroid
+    MIN_POINTS_PER_CENTROID = 39
+    # Growth past the trained on vectors after which the quantizer is considered stale
+    RETRAIN_FACTOR = 10
+
+    batcher: MicroBatcher = None
+
+    def __init__(self, vector_size, path: Path = None) -> None:
+        self.vector_size = vector_size
+        self.nlist = config.ivfpq_nlist or 1024
+        self.m = config.ivfpq_m or 64
+        while vector_size % self.m:
+            self.m -= 1
+        self.nprobe = config.ivfpq_nprobe or 16
+        self.train_size = config.ivfpq_train_size or self.TRAIN_SIZE
+        self.batch_size = config.indexer_batch_size or 256
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.deferred = False
+        self.open(path or self.current_path())
+        atexit.register(self.save)
+
+    def current_path(self) -> Path:
+        if CURRENT_FILE.exists():
+            return DIRNAME / CURRENT_FILE.read_text().strip()
+        return DIRNAME
+
+    def open(self, path: Path) -> None:
+        self.path = path
+        self.filename = path / 'index.npz'
+        self.mtime = None
+        self.coarse = None
+        self.codebooks = None
+        self.size = 0
+        self.alive_count = 0
+        self.raw = np.zeros((0, self.vector_size), dtype=np.float32)
+        self.codes = np.zeros((0, self.m), dtype=np.uint8)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.ids = []
+        self.metadata = []
+        self.rows = dict()
+        self.lists = None
+        self.trained_on = 0
+        self.warned = False
+        self.dirty = False
+        if self.filename.exists():
+            self.load()
+
+    def load(self) -> None:
+        self.mtime = self.filename.stat().st_mtime
+        with np.load(self.filename) as data:
+            if 'coarse' in data:
+                self.coarse = data['coarse']
+                self.codebooks = data['codebooks']
+                self.m = self.codebooks.shape[0]
+                self.trained_on = int(data['trained_on']) if 'trained_on' in data else 0
+            self.raw = data['raw']
+            self.codes = data['codes']
+            self.assign = data['assign']
+            self.alive = data['alive']
+            self.ids = json.loads(data['ids'].tobytes().decode('utf-8'))
+            self.metadata = json.loads(data['metadata'].tobytes().decode('utf-8'))
+        self.size = len(self.ids)
+        self.alive_count = int(self.alive.sum())
+        self.rows = dict((id, row) for row, id in enumerate(self.ids) if self.alive[row])
+        self.build_lists()
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            self.path.mkdir(parents=True, exist_ok=True)
+            size = self.size
+            arrays = dict(
+                raw=self.raw[:0 if self.trained() else size], codes=self.codes[:size],
+                assign=self.assign[:size], alive=self.alive[:size],
+                ids=np.frombuffer(json.dumps(self.ids).encode('utf-8'), dtype=np.uint8),
+                metadata=np.frombuffer(json.dumps(self.metadata).encode('utf-8'), dtype=np.uint8),
+            )
+            if self.trained():
+                arrays.update(coarse=self.coarse, codebooks=self.codebooks, trained_on=np.array(self.trained_on))
+            tmp = self.filename.with_suffix('.tmp.npz')
+            np.savez(tmp, **arrays)
+            os.replace(tmp, self.filename)
+            self.mtime = self.filename.stat().st_mtime
+            self.dirty = False
+
+    def trained(self) -> bool:
+        return self.coarse is not None
+
+    def train(self, vectors: np.ndarray) -> None:
+        rng = np.random.default_rng(0)
+        self.trained_on = len(vectors)
+        self.warned = False
+        if len(vectors) > self.SAMPLE_SIZE:
+            vectors = vectors[rng.choice(len(vectors), self.SAMPLE_SIZE, replace=False)]
+        nlist = max(1, min(self.nlist, len(vectors) // self.MIN_POINTS_PER_CENTROID))
+        self.coarse = kmeans(vectors, nlist)
+        residuals = vectors - self.coarse[nearest(vectors, self.coarse)]
+        dsub = self.vector_size // self.m
+        ksub = min(256, len(vectors))
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(residuals[:, j * dsub:(j + 1) * dsub]), ksub, iterations=10, seed=j)
+            for j in range(self.m)
+        ])
+
+    def encode(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        assign = nearest(vectors, self.coarse)
+        residuals = vectors - self.coarse[assign]
+        dsub = self.vector_size // self.m
+        codes = np.stack([
+            nearest(np.ascontiguousarray(residuals[:, j * dsub:(j + 1) * dsub]), self.codebooks[j])
+            for j in range(self.m)
+        ], axis=1).astype(np.uint8)
+        return codes, assign
+
+    async def index(self, dataset: Dataset, embedding: Embedding) -> None:
+        # Concurrent calls are buffered and added together
+        if not self.batcher:
+            self.batcher = MicroBatcher(self.index_many, max_items=self.batch_size, max_delay=config.indexer_batch_delay or 0.5)
+        await self.batcher.submit((dataset, embedding))
+
+    async def index_many(self, items: list[tuple[Dataset, Embedding]]) -> None:
+        if not items:
+            return
+        vectors = normalize(np.stack([np.asarray(embedding).reshape(-1) for _, embedding in items]))
+        ids = [dataset.storeId() for dataset, _ in items]
+        metadata = [dataset_metadata(dataset) for dataset, _ in items]
+        await asyncio.to_thread(self.internal_index_many, ids, vectors, metadata)
+
+    def internal_index_many(self, ids: list[str], vectors: np.ndarray, metadata: list[dict]) -> None:
+        with self.lock:
+            for id in ids:
+                row = self.rows.pop(id, None)
+                if row is not None:
+                    self.alive[row] = False
+                    self.alive_count -= 1
+            start = self.size
+            end = start + len(ids)
+            self.ids.extend(ids)
+            self.metadata.extend(metadata)
+            self.rows.update((id, start + i) for i, id in enumerate(ids))
+            self.alive = grow(self.alive, end)
+            self.alive[start:end] = True
+            self.alive_count += len(ids)
+            self.size = end
+            if self.trained():
+                codes, assign = self.encode(vectors)
+                self.codes = grow(self.codes, end)
+                self.assign = grow(self.assign, end)
+                self.codes[start:end] = codes
+                self.assign[start:end] = assign
+                self.extend_lists(np.arange(start, end), assign)
+                if not self.warned and self.alive_count > self.trained_on * self.RETRAIN_FACTOR:
+                    print(f'IVFPQ INDEX TRAINED ON {self.trained_on} VECTORS HAS {self.alive_count}, REINDEX TO RETRAIN')
+                    self.warned = True
+            else:
+                self.raw = grow(self.raw, end)
+                self.raw[start:end] = vectors
+                if end >= self.train_size and not self.deferred:
+                    self.train_raw()
+            if self.alive_count < self.size * 0.8:
+                self.compact()
+            self.dirty = True
+
+    def train_raw(self) -> None:
+        # Trains on the (alive) raw vectors, which are then encoded and dropped
+        raw = self.raw[:self.size]
+        self.train(raw[self.alive[:self.size]])
+        self.codes, self.assign = self.encode(raw)
+        self.raw = np.zeros((0, self.vector_size), dtype=np.float32)
+        self.build_lists()
+
+    def finish_build(self) -> None:
+        # A fresh index is trained once all its vectors are in
+        with self.lock:
+            if self.deferred:
+                self.deferred = False
+                if not self.trained() and self.size >= self.train_size:
+                    self.train_raw()
+                    self.dirty = True
+
+    def compact(self) -> None:
+        # Drops tombstoned rows
+        keep = np.flatnonzero(self.alive[:self.size])
+        if self.trained():
+            self.codes = self.codes[keep]
+            self.assign = self.assign[keep]
+        else:
+            self.raw = self.raw[keep]
+        self.ids = [self.ids[row] for row in keep]
+        self.metadata = [self.metadata[row] for row in keep]
+        self.size = self.alive_count = len(keep)
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.rows = dict((id, row) for row, id in enumerate(self.ids))
+        self.build_lists()
+
+    def build_lists(self) -> None:
+        # The rows of each coarse centroid, as growable arrays
+        if not self.trained():
+            self.lists = None
+            return
+        self.lists = [array('q') for _ in range(len(self.coarse))]
+        self.extend_lists(np.arange(self.size), self.assign[:self.size])
+
+    def extend_lists(self, rows: np.ndarray, assign: np.ndarray) -> None:
+        order = np.argsort(assign, kind='stable')
+        clusters, starts = np.unique(assign[order], return_index=True)
+        for cluster, group in zip(clusters, np.split(rows[order], starts[1:])):
+            self.lists[cluster].extend(group.tolist())
+
+    async def flush(self) -> None:
+        if self.batcher:
+            self.batcher.flush()
+            await asyncio.gather(*self.batcher.tasks)
+        await asyncio.to_thread(self.finish_build)
+        await asyncio.to_thread(self.save)
+
+    def fresh(self) -> 'IVFPQIndexer':
+        fresh = IVFPQIndexer(self.vector_size, DIRNAME / f'index-{time.time_ns()}')
+        fresh.deferred = True
+        return fresh
+
+    async def promote(self, fresh: 'IVFPQIndexer') -> None:
+        await fresh.flush()
+        old = self.path
+        DIRNAME.mkdir(parents=True, exist_ok=True)
+        tmp = CURRENT_FILE.with_suffix('.tmp')
+        tmp.write_text(fresh.path.name)
+        os.replace(tmp, CURRENT_FILE)
+        with self.lock:
+            self.open(fresh.path)
+        if old == DIRNAME:
+            (old / 'index.npz').unlink(missing_ok=True)
+        elif old != fresh.path:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def refresh(self) -> None:
+        # Picks up indexes saved or promoted by another process
+        path = self.current_path()
+        with self.lock:
+            if path != self.path:
+                self.open(path)
+            elif not self.dirty and self.filename.exists() and self.filename.stat().st_mtime != self.mtime:
+                self.load()
+
+    async def findDatasets(self, embedding: Embedding, num=10, filter: SearchFilter = None) -> list[tuple[str, float]]:
+        return (await self.find_many([embedding], num, filter))[0]
+
+    async def find_many(self, embeddings: list[Embedding], num=10, filter: SearchFilter = None) -> list[list[tuple[str, float]]]:
+        if not embeddings:
+            return []
+        queries = normalize(np.stack([np.asarray(embedding).reshape(-1) for embedding in embeddings]))
+        return await asyncio.to_thread(self.search, queries, num, filter)
+
+    def search(self, queries: np.ndarray, num: int, filter: SearchFilter) -> list[list[tuple[str, float]]]:
+        self.refresh()
+        with self.lock:
+            ret = []
+            for query in queries:
+                if self.trained():
+                    rows, scores = self.search_lists(query)
+                else:
+                    rows = np.arange(self.size)
+                    scores = self.raw[:self.size] @ query
+                keep = self.alive[rows]
+                if filter is not None and not filter.empty():
+                    keep &= np.array([filter.match(self.metadata[row], self.ids[row]) for row in rows], dtype=bool)
+                rows, scores = rows[keep], scores[keep]
+                idx, scores = top_k(scores[None, :], num)
+                ret.append([(self.ids[rows[i]], float(score)) for i, score in zip(idx[0], scores[0])])
+            return ret
+
+    def search_lists(self, query: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Inner product with a reconstructed vector = <query, centroid> + sum of <query part, code word>
+        coarse_scores = self.coarse @ query
+        nprobe = min(self.nprobe, len(self.coarse))
+        probe = np.argpartition(-coarse_scores, nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.frombuffer(self.lists[c], dtype=np.int64) for c in probe])
+        dsub = self.vector_size // self.m
+        lut = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(self.m, dsub))
+        scores = coarse_scores[self.assign[rows]] + lut[np.arange(self.m)[None, :], self.codes[rows]].sum(axis=1)
+        return rows, scores
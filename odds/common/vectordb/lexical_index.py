@@ -0,0 +1,106 @@
+import asyncio
+import re
+import sqlite3
+import threading
+
+from ..config import CACHE_DIR
+from ..datatypes import Dataset
+from .search_filter import SearchFilter, dataset_metadata
+
+FILENAME = CACHE_DIR / 'lexical_index.sqlite'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class LexicalIndex:
+
+    # BM25 full text index over dataset titles, descriptions, publishers and field names (sqlite FTS5)
+
+    COLUMNS = ('title', 'description', 'publisher', 'fields')
+    METADATA = ('catalogId', 'geo', 'loaded', 'row_count')
+    # Relative importance of each column in the bm25 score
+    WEIGHTS = (4.0, 1.0, 2.0, 1.0)
+
+    def __init__(self, filename=FILENAME) -> None:
+        self.filename = filename
+        self.db = None
+        self.lock = threading.Lock()
+
+    def getDB(self) -> sqlite3.Connection:
+        if self.db is None:
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.filename), timeout=30, check_same_thread=False)
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(datasets)')]
+            if columns and columns != ['id', *self.COLUMNS, *self.METADATA]:
+                # Created with an older set of columns, to be refilled on reindexing
+                self.db.execute('DROP TABLE datasets')
+            self.db.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS datasets USING fts5(id UNINDEXED, {", ".join(self.COLUMNS)}, '
+                f'{", ".join(c + " UNINDEXED" for c in self.METADATA)}, '
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+        return self.db
+
+    def document(self, dataset: Dataset) -> tuple[str, ...]:
+        titles = [dataset.better_title, dataset.title]
+        descriptions = [dataset.better_description, dataset.description]
+        fields = set(
+            field.name
+            for resource in dataset.resources if resource.status_loaded
+            for field in resource.fields
+        )
+        return (
+            '\n'.join(t for t in titles if t),
+            '\n'.join(d for d in descriptions if d),
+            '\n'.join(p for p in [dataset.publisher, dataset.publisher_description] if p),
+            ' '.join(sorted(fields)),
+        )
+
+    async def index(self, dataset: Dataset) -> None:
+        await self.index_many([dataset])
+
+    async def index_many(self, datasets: list[Dataset]) -> None:
+        rows = []
+        for dataset in datasets:
+            metadata = dataset_metadata(dataset)
+            rows.append((dataset.storeId(), *self.document(dataset), *[metadata[k] for k in self.METADATA]))
+        await asyncio.to_thread(self.internal_index_many, rows)
+
+    def internal_index_many(self, rows: list[tuple[str, ...]]) -> None:
+        with self.lock:
+            db = self.getDB()
+            db.executemany('DELETE FROM datasets WHERE id = ?', [(row[0],) for row in rows])
+            columns = ['id', *self.COLUMNS, *self.METADATA]
+            db.executemany(f'INSERT INTO datasets ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})', rows)
+            db.commit()
+
+    def match_expression(self, query: str) -> str:
+        # Any of the query's tokens, quoted so they are never parsed as FTS5 syntax
+        tokens = TOKEN_RE.findall(query)
+        return ' OR '.join('"{}"'.format(token) for token in dict.fromkeys(tokens))
+
+    async def search(self, query: str, num=10, filter: SearchFilter = None) -> list[tuple[str, float]]:
+        # (dataset id, score) pairs, best match first
+        return (await self.search_many([query], num, filter))[0]
+
+    async def search_many(self, queries: list[str], num=10, filter: SearchFilter = None) -> list[list[tuple[str, float]]]:
+        return await asyncio.to_thread(self.internal_search_many, queries, num, filter)
+
+    def internal_search_many(self, queries: list[str], num: int, filter: SearchFilter) -> list[list[tuple[str, float]]]:
+        ret = []
+        where, params = filter.sql() if filter else ('', [])
+        where = f' AND {where}' if where else ''
+        weights = ', '.join(map(str, (0, *self.WEIGHTS, *[0] * len(self.METADATA))))
+        with self.lock:
+            db = self.getDB()
+            for query in queries:
+                expression = self.match_expression(query)
+                if not expression:
+                    ret.append([])
+                    continue
+                # bm25() is lower for better matches
+                rows = db.execute(
+                    f'SELECT id, -bm25(datasets, {weights}) AS score FROM datasets WHERE datasets MATCH ?{where} ORDER BY score DESC LIMIT ?',
+                    (expression, *params, num)
+                )
+                ret.append([(row[0], row[1]) for row in rows])
+        return ret
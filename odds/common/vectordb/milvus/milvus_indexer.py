@@ -1,91 +1,117 @@
+import asyncio
+import time
+
 from pymilvus import MilvusClient, DataType
-import httpx
 
-from ...config import config
+from ..indexer import Indexer
+from ..search_filter import SearchFilter, dataset_metadata
+from ...batcher import MicroBatcher
+from ...config import config, CACHE_DIR
 from ...datatypes import Embedding, Dataset
 
 
-class MilvusIndexer:
+class MilvusIndexer(Indexer):
+
+    # Vectors keyed by the dataset's store id (upserted, so reindexing replaces rows), along with
+    # their filterable metadata. Connects to endpoints.milvus.host, or to a local Milvus Lite file.
+    # Rebuilt indexes are created as new collections and swapped in by pointing the alias at them.
 
     COLLECTION_NAME = 'datasets'
+    BATCH_SIZE = 256
+    MAX_ID_LENGTH = 1024
 
-    def __init__(self, vector_size) -> None:
+    batcher: MicroBatcher = None
+
+    def __init__(self, vector_size, collection_name=None) -> None:
+        self.vector_size = vector_size
+        self.collection_name = collection_name or self.COLLECTION_NAME
+        endpoint = config.endpoints.milvus if config.endpoints else None
+        credentials = config.credentials.milvus if config.credentials else None
         self.client = MilvusClient(
-            uri=config.endpoints.milvus.host,
-            token=config.credentials.milvus.token,
+            uri=(endpoint.host if endpoint else None) or str(CACHE_DIR / 'milvus.db'),
+            token=(credentials.token if credentials else None) or '',
         )
-        if self.COLLECTION_NAME not in self.client.list_collections():
-            self.client.create_collection(self.COLLECTION_NAME, vector_size)
+        self.batch_size = config.indexer_batch_size or self.BATCH_SIZE
+        if not self.client.has_collection(self.collection_name):
+            self.create_collection(self.collection_name, vector_size)
 
     def create_collection(self, name, vector_size) -> None:
-        # schema = MilvusClient.create_schema(
-        #     auto_id=True,
-        #     enable_dynamic_field=True,
-        # )
-
-        # schema.add_field(field_name='id', datatype=DataType.INT64, is_primary=True)
-        # schema.add_field(field_name='embedding', datatype=DataType.FLOAT_VECTOR, dim=vector_size)
-        # schema.add_field(field_name='dataset_id', datatype=DataType.STRING)
+        schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=False)
+        schema.add_field(field_name='id', datatype=DataType.VARCHAR, is_primary=True, max_length=self.MAX_ID_LENGTH)
+        schema.add_field(field_name='vector', datatype=DataType.FLOAT_VECTOR, dim=vector_size)
+        schema.add_field(field_name='catalogId', datatype=DataType.VARCHAR, max_length=256)
+        schema.add_field(field_name='geo', datatype=DataType.VARCHAR, max_length=256)
+        schema.add_field(field_name='loaded', datatype=DataType.BOOL)
+        schema.add_field(field_name='row_count', datatype=DataType.INT64)
 
-        # index_params = self.client.prepare_index_params()
-
-        # index_params.add_index(
-        #     field_name='id',
-        #     index_type='STL_SORT'
-        # )
-
-        # index_params.add_index(
-        #     field_name='embedding', 
-        #     index_type='AUTOINDEX',
-        #     metric_type='L2',
-        #     params={'nlist': 128}
-        # )
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(field_name='vector', index_type='AUTOINDEX', metric_type='COSINE')
 
         self.client.create_collection(
             collection_name=name,
-            dimension=vector_size,
-            auto_id=True,
-            metric_type='COSINE',
-            # id_type='string',
-            # schema=schema,
-            # index_params=index_params
+            schema=schema,
+            index_params=index_params,
         )
-        
+
+    def fresh(self) -> 'MilvusIndexer':
+        return MilvusIndexer(self.vector_size, f'{self.COLLECTION_NAME}_{time.time_ns()}')
+
+    async def promote(self, fresh: 'MilvusIndexer') -> None:
+        await asyncio.to_thread(self.internal_promote, fresh.collection_name)
+
+    def internal_promote(self, collection_name: str) -> None:
+        alias = self.COLLECTION_NAME
+        if alias in self.client.list_collections():
+            # A plain collection created before aliases were used
+            self.client.drop_collection(alias)
+            self.client.create_alias(collection_name, alias)
+            return
+        try:
+            old = self.client.describe_alias(alias)['collection_name']
+        except Exception:
+            old = None
+        if old is None:
+            self.client.create_alias(collection_name, alias)
+        else:
+            self.client.alter_alias(collection_name, alias)
+            if old != collection_name:
+                self.client.drop_collection(old)
 
     async def index(self, dataset: Dataset, embedding: Embedding) -> None:
-        # async with httpx.AsyncClient() as client:
-        #     params = {
-        #         'collectionName': self.COLLECTION_NAME,
-        #         'data': [{
-        #             # 'dataset_id': dataset.storeId(),
-        #             'vector': embedding.tolist()
-        #         }]
-        #     }
-        #     headers = {
-        #         'content-type': 'application/json',
-        #     }
-        #     r = await client.post(
-        #         f'{config.endpoints.milvus.host}/v1/vector/insert',
-        #         json=params,
-        #         headers=headers,
-        #         timeout=60
-        #     )
-        #     r.raise_for_status()
-        #     print('RRR33', r.json(), params, len(params['data'][0]['vector']))
-        ret = self.client.insert(collection_name=self.COLLECTION_NAME, data=[{'id': dataset.storeId(), 'vector': embedding.tolist()}])
-        print('RRR33', ret)
-    
-    async def findDatasets(self, embedding: Embedding, num=10) -> list[Dataset]:
-        async with httpx.AsyncClient() as client:
-            params = {
-                'collectionName': self.COLLECTION_NAME,
-                'vector': embedding.tolist(),
-            }
-            r = await client.post(
-                f'{config.endpoints.milvus.host}/v1/vector/search',
-                json=params,
-                timeout=60
-            )
-            r.raise_for_status()
-            print('RRR', r.json())
-            assert False
+        # Concurrent calls are buffered and upserted together
+        if not self.batcher:
+            self.batcher = MicroBatcher(self.index_many, max_items=self.batch_size, max_delay=config.indexer_batch_delay or 0.5)
+        await self.batcher.submit((dataset, embedding))
+
+    async def index_many(self, items: list[tuple[Dataset, Embedding]]) -> None:
+        # Later items win if the same dataset appears twice
+        rows = dict(
+            (dataset.storeId(), dict(id=dataset.storeId(), vector=embedding.tolist(), **dataset_metadata(dataset)))
+            for dataset, embedding in items
+        )
+        rows = list(rows.values())
+        for i in range(0, len(rows), self.batch_size):
+            await asyncio.to_thread(self.client.upsert, collection_name=self.collection_name, data=rows[i:i+self.batch_size])
+
+    async def flush(self) -> None:
+        if self.batcher:
+            self.batcher.flush()
+            await asyncio.gather(*self.batcher.tasks)
+
+    async def findDatasets(self, embedding: Embedding, num=10, filter: SearchFilter = None) -> list[tuple[str, float]]:
+        return (await self.find_many([embedding], num, filter))[0]
+
+    async def find_many(self, embeddings: list[Embedding], num=10, filter: SearchFilter = None) -> list[list[tuple[str, float]]]:
+        if not embeddings:
+            return []
+        ret = await asyncio.to_thread(
+            self.client.search,
+            collection_name=self.collection_name,
+            data=[embedding.tolist() for embedding in embeddings],
+            limit=num,
+            filter=(filter.milvus_expr() if filter else None) or '',
+            output_fields=['id'],
+            search_params={'metric_type': 'COSINE'},
+        )
+        # With the COSINE metric, the returned distance is the similarity
+        return [[(hit['id'], hit['distance']) for hit in hits] for hits in ret]
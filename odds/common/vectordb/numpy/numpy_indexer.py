@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ..indexer import Indexer
+from ..search_filter import SearchFilter, dataset_metadata
+from ...config import config, CACHE_DIR
+from ...datatypes import Embedding, Dataset
+from ...quantization import QuantizedVectors, top_k, merge_top_k
+from ...store.embedding_matrix import EmbeddingMatrix
+
+DIRNAME = CACHE_DIR / '.numpy-index'
+# Name of the subdirectory in use, switched when a rebuilt index is promoted
+CURRENT_FILE = DIRNAME / 'current'
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class NumpyIndexer(Indexer):
+
+    # Exact (brute force) cosine similarity search over normalized vectors, kept in
+    # a memory mapped EmbeddingMatrix. With numpy_indexer_format set to float16 or int8,
+    # queries scan an in-memory quantized copy and rescore the candidates at full precision.
+    # Dataset metadata is appended to metadata.jsonl (last record wins) and filters are applied
+    # by restricting the scan to the matching rows.
+    # Searches and writes run in worker threads, and share the index state under a (reentrant) lock.
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, vector_size, path: Path = None) -> None:
+        self.vector_size = vector_size
+        self.format = config.numpy_indexer_format or 'float32'
+        self.lock = None
+        self.thread_lock = threading.RLock()
+        self.open(path or self.current_path())
+
+    def current_path(self) -> Path:
+        if CURRENT_FILE.exists():
+            return DIRNAME / CURRENT_FILE.read_text().strip()
+        return DIRNAME
+
+    def open(self, path: Path) -> None:
+        self.path = path
+        self.matrix = EmbeddingMatrix(path)
+        self.quantized = None
+        self.metadata_file = path / 'metadata.jsonl'
+        self.metadata = dict()
+        self.metadata_size = 0
+        self.filter_rows = dict()
+
+    def fresh(self) -> 'NumpyIndexer':
+        return NumpyIndexer(self.vector_size, DIRNAME / f'index-{time.time_ns()}')
+
+    async def promote(self, fresh: 'NumpyIndexer') -> None:
+        await asyncio.to_thread(self.internal_promote, fresh.path)
+
+    def internal_promote(self, path: Path) -> None:
+        with self.thread_lock:
+            old = self.path
+            DIRNAME.mkdir(parents=True, exist_ok=True)
+            tmp = CURRENT_FILE.with_suffix('.tmp')
+            tmp.write_text(path.name)
+            os.replace(tmp, CURRENT_FILE)
+            self.open(path)
+            if old == DIRNAME:
+                for name in ('vectors.bin', 'scales.f32', 'ids.txt', 'meta.json', 'metadata.jsonl'):
+                    (old / name).unlink(missing_ok=True)
+            elif old != path:
+                shutil.rmtree(old, ignore_errors=True)
+
+    async def index(self, dataset: Dataset, embedding: Embedding) -> None:
+        await self.index_many([(dataset, embedding)])
+
+    async def index_many(self, items: list[tuple[Dataset, Embedding]]) -> None:
+        if not items:
+            return
+        if not self.lock:
+            self.lock = asyncio.Lock()
+        vectors = normalize(np.stack([np.asarray(embedding).reshape(-1) for _, embedding in items]))
+        ids = [dataset.storeId() for dataset, _ in items]
+        metadata = [dataset_metadata(dataset) for dataset, _ in items]
+        async with self.lock:
+            await asyncio.to_thread(self.internal_index_many, ids, vectors, metadata)
+
+    def internal_index_many(self, ids: list[str], vectors: np.ndarray, metadata: list[dict]) -> None:
+        with self.thread_lock:
+            if any(id in self.matrix.rows for id in ids):
+                # Rows are overwritten in place, the quantized copy needs to be rebuilt
+                self.quantized = None
+            self.matrix.set_many(ids, vectors)
+            self.matrix.path.mkdir(parents=True, exist_ok=True)
+            self.refresh_metadata()
+            content = ''.join(json.dumps(dict(id=id, **m)) + '\n' for id, m in zip(ids, metadata)).encode('utf-8')
+            with self.metadata_file.open('ab') as file:
+                file.write(content)
+            self.metadata_size += len(content)
+            self.metadata.update(zip(ids, metadata))
+            self.filter_rows.clear()
+
+    def refresh_metadata(self) -> None:
+        # Picks up records appended since the last read (possibly by another process)
+        with self.thread_lock:
+            if not self.metadata_file.exists() or self.metadata_file.stat().st_size == self.metadata_size:
+                return
+            with self.metadata_file.open('rb') as file:
+                file.seek(self.metadata_size)
+                content = file.read()
+            complete = content[:content.rfind(b'\n') + 1]
+            self.metadata_size += len(complete)
+            for line in complete.decode('utf-8').splitlines():
+                record = json.loads(line)
+                self.metadata[record.pop('id')] = record
+            self.filter_rows.clear()
+
+    def rows(self, filter: SearchFilter) -> np.ndarray:
+        # Row numbers matching the filter, or None for all rows (called with the lock held)
+        if filter is None or filter.empty():
+            return None
+        self.refresh_metadata()
+        size = len(self.matrix)
+        key = (filter, size)
+        rows = self.filter_rows.get(key)
+        if rows is None:
+            ids = self.matrix.ids
+            rows = np.array([row for row in range(size) if filter.match(self.metadata.get(ids[row]), ids[row])], dtype=np.int64)
+            self.filter_rows.clear()
+            self.filter_rows[key] = rows
+        return rows
+
+    async def findDatasets(self, embedding: Embedding, num=10, filter: SearchFilter = None) -> list[tuple[str, float]]:
+        return (await self.find_many([embedding], num, filter))[0]
+
+    async def find_many(self, embeddings: list[Embedding], num=10, filter: SearchFilter = None) -> list[list[tuple[str, float]]]:
+        if not embeddings:
+            return []
+        queries = normalize(np.stack([np.asarray(embedding).reshape(-1) for embedding in embeddings]))
+        return await asyncio.to_thread(self.search, queries, num, filter)
+
+    def search(self, queries: np.ndarray, num: int, filter: SearchFilter = None) -> list[list[tuple[str, float]]]:
+        with self.thread_lock:
+            if self.path != self.current_path():
+                # Promoted by another process
+                self.open(self.current_path())
+            allowed = self.rows(filter)
+            if self.format != 'float32':
+                rows, scores = self.search_quantized(queries, num, allowed)
+            else:
+                rows, scores = self.search_full(queries, num, allowed)
+            ids = self.matrix.ids
+            return [
+                [(ids[row], float(score)) for row, score in zip(query_rows, query_scores)]
+                for query_rows, query_scores in zip(rows, scores)
+            ]
+
+    def search_full(self, queries: np.ndarray, num: int, allowed: np.ndarray = None) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        matrix = self.matrix.array()
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(matrix) if allowed is None else len(allowed), self.CHUNK_SIZE):
+            chunk = slice(start, start + self.CHUNK_SIZE) if allowed is None else allowed[start:start + self.CHUNK_SIZE]
+            rows, scores = top_k(queries @ matrix[chunk].T, num)
+            rows = rows + start if allowed is None else chunk[rows]
+            best_rows, best_scores = merge_top_k(best_rows, best_scores, rows, scores, num)
+        return best_rows, best_scores
+
+    def search_quantized(self, queries: np.ndarray, num: int, allowed: np.ndarray = None) -> tuple[list[np.ndarray], list[np.ndarray]]:
+        size = len(self.matrix)
+        if self.quantized is None:
+            self.quantized = QuantizedVectors(self.matrix.vectors(slice(0, size)), self.format)
+        elif len(self.quantized) < size:
+            self.quantized.append(self.matrix.vectors(slice(len(self.quantized), size)))
+        if allowed is not None:
+            allowed = allowed[allowed < len(self.quantized)]
+        return self.quantized.search_many(queries, num, self.matrix.vectors, self.CHUNK_SIZE, allowed)
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+import json
+
+from ..catalog_repo import catalog_repo
+from ..config import config
+from ..datatypes import Dataset
+
+
+def dataset_metadata(dataset: Dataset) -> dict:
+    # Filterable attributes of a dataset, as stored alongside its vector
+    catalog = catalog_repo.get_catalog(dataset.catalogId)
+    loaded = [resource for resource in dataset.resources if resource.status_loaded]
+    return dict(
+        catalogId=dataset.catalogId,
+        geo=(catalog.geo if catalog else None) or '',
+        loaded=len(loaded) > 0,
+        row_count=sum(resource.row_count or 0 for resource in loaded),
+    )
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    catalogIds: tuple[str, ...] = None
+    geos: tuple[str, ...] = None
+    loaded_only: bool = False
+    min_rows: int = None
+
+    def empty(self) -> bool:
+        return not self.catalogIds and not self.geos and not self.loaded_only and not self.min_rows
+
+    @staticmethod
+    def pass_unknown() -> bool:
+        # Vectors indexed before metadata was stored alongside them have none (until reindexed).
+        # Their catalog is known from their store id, other unknown values fail unless opted in.
+        return bool(config.search_filter_pass_unknown)
+
+    def match(self, metadata: dict, id: str = None) -> bool:
+        metadata = metadata or dict()
+        catalogId, geo, loaded, row_count = (metadata.get(k) for k in ('catalogId', 'geo', 'loaded', 'row_count'))
+        if catalogId is None and id:
+            catalogId = id.split('/', 1)[0]
+        unknown = self.pass_unknown()
+        return (
+            (not self.catalogIds or catalogId in self.catalogIds) and
+            (not self.geos or (geo in self.geos if geo is not None else unknown)) and
+            (not self.loaded_only or (bool(loaded) if loaded is not None else unknown)) and
+            (not self.min_rows or (row_count >= self.min_rows if row_count is not None else unknown))
+        )
+
+    def chroma_where(self) -> dict:
+        conditions = []
+        if self.catalogIds:
+            conditions.append({'catalogId': {'$in': list(self.catalogIds)}})
+        if self.geos:
+            conditions.append({'geo': {'$in': list(self.geos)}})
+        if self.loaded_only:
+            conditions.append({'loaded': True})
+        if self.min_rows:
+            conditions.append({'row_count': {'$gte': self.min_rows}})
+        if len(conditions) > 1:
+            return {'$and': conditions}
+        return conditions[0] if conditions else None
+
+    def milvus_expr(self) -> str:
+        conditions = []
+        for field, values in (('catalogId', self.catalogIds), ('geo', self.geos)):
+            if values:
+                conditions.append(f'{field} in {json.dumps(list(values), ensure_ascii=False)}')
+        if self.loaded_only:
+            conditions.append('loaded == true')
+        if self.min_rows:
+            conditions.append(f'row_count >= {int(self.min_rows)}')
+        return ' and '.join(conditions)
+
+    def sql(self) -> tuple[str, list]:
+        # A WHERE clause (or '') and its parameters, for tables with an id and the metadata columns (NULL when unknown)
+        conditions = []
+        params = []
+        unknown = ' OR {} IS NULL' if self.pass_unknown() else ''
+        if self.catalogIds:
+            placeholders = ', '.join('?' * len(self.catalogIds))
+            conditions.append(f"(catalogId IN ({placeholders}) OR (catalogId IS NULL AND substr(id, 1, instr(id, '/') - 1) IN ({placeholders})))")
+            params.extend(self.catalogIds)
+            params.extend(self.catalogIds)
+        if self.geos:
+            conditions.append(f'(geo IN ({", ".join("?" * len(self.geos))}){unknown.format("geo")})')
+            params.extend(self.geos)
+        if self.loaded_only:
+            conditions.append(f'(loaded = 1{unknown.format("loaded")})')
+        if self.min_rows:
+            conditions.append(f'(row_count >= ?{unknown.format("row_count")})')
+            params.append(self.min_rows)
+        return ' AND '.join(conditions), params
@@ -1,12 +1,12 @@
 import asyncio
-from collections import Counter
+from typing import AsyncIterator
 import sqlite3
 
 from slugify import slugify
 from .steps import *
-from ..common.vectordb import indexer
+from ..common.vectordb.dataset_search import find_datasets
+from ..common.vectordb.search_filter import SearchFilter
 from ..common.store import store
-from ..common.embedder import embedder
 from ..common.datatypes import Dataset, Resource
 from ..common.catalog_repo import catalog_repo
 
@@ -35,12 +35,14 @@ class ODDSFrontend:
     
     async def fetch_data(self, datapoint: str, conversation: list[str]=[]) -> str:
         conversation = conversation + [datapoint] # [slugify(datapoint, separator='_')[:64]]
+        data, data_explanation = await self.find_data(datapoint, conversation=conversation)
+        statement = await convert_to_statement(datapoint, data, data_explanation, conversation=conversation)
+        return statement
+
+    async def find_data(self, datapoint: str, conversation: list[str]=[]) -> tuple[list[dict], str]:
         possible_dataset_names = await guess_dataset_names(datapoint, conversation=conversation)
-        embeddings = await asyncio.gather(*[embedder.embed(name) for name in possible_dataset_names])
-        dataset_ids = await asyncio.gather(*[indexer.findDatasets(embedding) for embedding in embeddings])
-        # flatten dataset_ids:
-        dataset_ids = [x for y in dataset_ids for x in y]
-        dataset_ids = [x[0] for x in Counter(dataset_ids).most_common(10)]
+        # Only datasets with loaded resources can provide data
+        dataset_ids = [id for id, _ in await find_datasets(possible_dataset_names, filter=SearchFilter(loaded_only=True))]
         datasets = await asyncio.gather(*[store.getDataset(id) for id in dataset_ids])
         catalogs = [catalog_repo.get_catalog(dataset.catalogId) for dataset in datasets]
         dataset_id = await select_best_dataset(datapoint, datasets, catalogs, conversation=conversation)
@@ -60,9 +62,57 @@ class ODDSFrontend:
                             data = await self.query_db(dataset, resource, query)
                             data_explanation = explanation
                             assert data is not None
-        statement = await convert_to_statement(datapoint, data, data_explanation, conversation=conversation)
+        return data, data_explanation
+
+    async def analyze_text_stream(self, text: str) -> AsyncIterator[dict]:
+        # Same flow as analyze_text, yielding events as soon as they are available:
+        #   claims - the claims extracted from the text
+        #   statement - a (partial or final) statement for a single datapoint
+        #   verdict - a (partial or final) verdict for a single subclaim
+        queue = asyncio.Queue()
+        task = asyncio.create_task(self.stream_text(text, queue))
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            await task
+        finally:
+            # The consumer stopped early (e.g. the client disconnected): no more LLM calls
+            # are needed, and the outcome of the cancelled task is retrieved so it isn't logged
+            if not task.done():
+                task.cancel()
+                task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def stream_text(self, text: str, queue: asyncio.Queue) -> None:
+        try:
+            conversation = ['text']
+            claims = await extract_claims(text, conversation=conversation)
+            queue.put_nowait(dict(kind='claims', claims=claims))
+            await asyncio.gather(*[self.stream_claim(claim, queue, conversation=conversation) for claim in claims[:1]])
+        finally:
+            queue.put_nowait(None)
+
+    async def stream_claim(self, claim: str, queue: asyncio.Queue, conversation: list[str]=[]) -> None:
+        conversation = conversation + [claim]
+        subclaims = await simplify_claim(claim, conversation=conversation)
+        await asyncio.gather(*[self.stream_subclaim(claim, subclaim, queue, conversation=conversation) for subclaim in subclaims])
+
+    async def stream_subclaim(self, claim: str, subclaim: str, queue: asyncio.Queue, conversation: list[str]=[]) -> None:
+        conversation = conversation + [subclaim]
+        datapoints = await extract_datapoints(subclaim, conversation=conversation)
+        statements = await asyncio.gather(*[self.stream_datapoint(subclaim, datapoint, queue, conversation=conversation) for datapoint in datapoints])
+        async for final, verdict in compose_subclaim_verdict.stream(subclaim, statements, conversation=conversation):
+            queue.put_nowait(dict(kind='verdict', claim=claim, subclaim=subclaim, verdict=verdict, final=final))
+
+    async def stream_datapoint(self, subclaim: str, datapoint: str, queue: asyncio.Queue, conversation: list[str]=[]) -> str:
+        conversation = conversation + [datapoint]
+        data, data_explanation = await self.find_data(datapoint, conversation=conversation)
+        statement = None
+        async for final, statement in convert_to_statement.stream(datapoint, data, data_explanation, conversation=conversation):
+            queue.put_nowait(dict(kind='statement', subclaim=subclaim, datapoint=datapoint, statement=statement, final=final))
         return statement
-        
 
     async def query_db(self, dataset: Dataset, resource: Resource, query: str) -> str:
         dbFile = await store.getDB(resource, dataset)
@@ -4,6 +4,7 @@ import json
 
 from ...common.datatypes import Dataset, Resource
 from ...common.store import store
+from ...common.llm.prompt_builder import fit_lines, truncate_tokens
 
 from .frontend_query import FrontendQueryRunner, FrontendQuery
 
@@ -32,6 +33,9 @@ DB Schema:
 {schema}
 ''' 
 
+MAX_FIELDS_TOKENS = 3000
+MAX_SCHEMA_TOKENS = 3000
+
 
 class ComposeQuery(FrontendQuery):
 
@@ -50,9 +54,8 @@ class ComposeQuery(FrontendQuery):
             f'`{f.pop('name')}` ({f.pop('data_type')}): {json.dumps(f, ensure_ascii=False)}'
             for f in fields
         ]
-        if len(fields) > 20:
-            fields = fields[:15] + ['...'] + fields[-5:]
-        fields = '\n'.join(f'  - {f}' for f in fields)
+        fields = fit_lines([f'  - {f}' for f in fields], MAX_FIELDS_TOKENS, ellipsis='  - ...')
+        fields = '\n'.join(fields)
         dataset_name = self.dataset.better_title
         dataset_description = self.dataset.better_description
         resource_name = self.resource.title or 'Data'
@@ -61,7 +64,7 @@ class ComposeQuery(FrontendQuery):
             ('system', 'You are an experienced data analyst and DB master.'),
             ('user', INSTRUCTION.format(
                 datapoint=self.datapoint,
-                schema=self.resource.db_schema,
+                schema=truncate_tokens(self.resource.db_schema, MAX_SCHEMA_TOKENS),
                 fields=fields,
                 dataset_name=dataset_name,
                 dataset_description=dataset_description,
@@ -82,6 +85,12 @@ class ComposeQuery(FrontendQuery):
         if explanation.startswith('--'):
             explanation = explanation[2:].strip()
         return (result, explanation) if result else (None, None)
+
+    def semantic_key(self) -> tuple[str, str]:
+        return self.datapoint, f'{self.dataset.storeId()}/{self.resource.url}'
+
+    def semantic_exact(self) -> bool:
+        return True
     
     def expects_json(self) -> bool:
         return False
@@ -26,6 +26,12 @@ class ExtractDatapoints(FrontendQuery):
     def handle_result(self, result: list[str]) -> Any:
         return result
 
+    def semantic_key(self) -> tuple[str, str]:
+        return self.claim, ''
+
+    def semantic_exact(self) -> bool:
+        return True
+
 
 extract_datapoints = FrontendQueryRunner(ExtractDatapoints)
 
@@ -1,9 +1,12 @@
 import asyncio
-from typing import Any, Type
+import copy
+from typing import Any, AsyncIterator, Type
 
 from ...common.llm.llm_query import LLMQuery
 from ...common.llm import llm_runner
+from ...common.embedder import embedder
 from ...common.config import config
+from .semantic_cache import SemanticCache, literal_tokens, normalize_text
 
 
 class FrontendQuery(LLMQuery):
@@ -23,6 +26,16 @@ class FrontendQuery(LLMQuery):
     def handle_result(self, result: dict) -> Any:
         pass
 
+    def semantic_key(self) -> tuple[str, str]:
+        # (text, context) for queries whose results may be reused for semantically similar text
+        # within the same context, or None if results shouldn't be cached
+        return None
+
+    def semantic_exact(self) -> bool:
+        # Results which hinge on the text's exact wording (e.g. polarity or place, which
+        # embeddings barely tell apart) are only reused for the same normalized text
+        return False
+
 
 class FrontendQueryRunner:
 
@@ -31,14 +44,69 @@ class FrontendQueryRunner:
 
     def __init__(self, query_cls: Type[LLMQuery]):
         self.query_cls = query_cls
+        self.cache = None
+        if not config.disable_semantic_cache:
+            self.cache = SemanticCache(
+                threshold=config.semantic_cache_threshold or 0.97,
+                ttl=config.semantic_cache_ttl or 3600,
+                max_size=config.semantic_cache_size or 1000,
+            )
+
+    async def lookup(self, query: FrontendQuery) -> tuple[bool, Any, Any]:
+        key = query.semantic_key() if self.cache is not None else None
+        if key is None:
+            return False, None, None
+        text, context = key
+        if query.semantic_exact():
+            context = f'{context}|{normalize_text(text)}'
+            hit, ret = self.cache.get(None, context)
+            return hit, copy.deepcopy(ret), (None, context)
+        context = f'{context}|{literal_tokens(text)}'
+        try:
+            embedding = await embedder.embed(text)
+        except Exception as e:
+            print('FQ', self.query_cls.__name__, 'FAILED TO EMBED', repr(e))
+            return False, None, None
+        if embedding is None:
+            return False, None, None
+        hit, ret = self.cache.get(embedding, context)
+        if hit and config.debug:
+            print('FQ', self.query_cls.__name__, 'CACHED', repr(ret)[:200])
+        return hit, copy.deepcopy(ret), (embedding, context)
+
+    def remember(self, key: Any, ret: Any) -> None:
+        if key is not None and ret is not None:
+            embedding, context = key
+            self.cache.set(embedding, context, copy.deepcopy(ret))
 
     async def __call__(self, *args, **kwargs) -> None:
         if not self.sem:
             self.sem = asyncio.Semaphore(self.concurrency_limit)
         conversation = kwargs.get('conversation', [])
+        query = self.query_cls(*args)
+        hit, ret, key = await self.lookup(query)
+        if hit:
+            return ret
         async with self.sem:
-            query = self.query_cls(*args)
             ret = await llm_runner.run(query, conversation=conversation)
             if config.debug:
                 print('FQ', self.query_cls.__name__, repr(ret)[:200])
-            return ret
+        self.remember(key, ret)
+        return ret
+
+    async def stream(self, *args, **kwargs) -> AsyncIterator[tuple[bool, Any]]:
+        if not self.sem:
+            self.sem = asyncio.Semaphore(self.concurrency_limit)
+        conversation = kwargs.get('conversation', [])
+        query = self.query_cls(*args)
+        hit, ret, key = await self.lookup(query)
+        if hit:
+            yield True, ret
+            return
+        async with self.sem:
+            async for final, ret in llm_runner.run_stream(query, conversation=conversation):
+                if final:
+                    if config.debug:
+                        print('FQ', self.query_cls.__name__, repr(ret)[:200])
+                    self.remember(key, ret)
+                yield final, ret
@@ -24,6 +24,9 @@ class GuessDatasetNames(FrontendQuery):
     def handle_result(self, result: list[str]) -> Any:
         return result
 
+    def semantic_key(self) -> tuple[str, str]:
+        return self.datapoint, ''
+
 
 guess_dataset_names = FrontendQueryRunner(GuessDatasetNames)
 
@@ -54,5 +54,8 @@ class SelectBestDataset(FrontendQuery):
             return dataset_id
         return None
 
+    def semantic_key(self) -> tuple[str, str]:
+        return self.datapoint, ','.join(d.storeId() for d in self.datasets)
+
 select_best_dataset = FrontendQueryRunner(SelectBestDataset)
 
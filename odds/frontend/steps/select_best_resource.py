@@ -4,6 +4,7 @@ from dataclasses import asdict
 
 from ...common.datatypes import Dataset
 from ...common.store import store
+from ...common.llm.prompt_builder import fit_lines
 
 from .frontend_query import FrontendQueryRunner, FrontendQuery
 
@@ -30,6 +31,8 @@ Data files:
 {resources}
 ''' 
 
+MAX_RESOURCES_TOKENS = 8000
+
 
 class SelectBestResource(FrontendQuery):
 
@@ -38,9 +41,9 @@ class SelectBestResource(FrontendQuery):
         self.datapoint = datapoint
         self.dataset = dataset
         self.resources = []
-        for i, r in enumerate(self.dataset.resources):
-            if not r.status_loaded:
-                continue
+        loaded = [(i, r) for i, r in enumerate(self.dataset.resources) if r.status_loaded]
+        fields_budget = MAX_RESOURCES_TOKENS // max(len(loaded), 1)
+        for i, r in loaded:
             fields = [
                 {k:v for k,v in asdict(f).items() if v is not None}
                 for f in r.fields
@@ -49,13 +52,12 @@ class SelectBestResource(FrontendQuery):
                 f'`{f.pop('name')}` ({f.pop('data_type')}): {json.dumps(f, ensure_ascii=False)}'
                 for f in fields
             ]
-            if len(fields) > 20:
-                fields = fields[:15] + ['...'] + fields[-5:]
+            fields = fit_lines([f'    - {f}' for f in fields], fields_budget, ellipsis='    - ...')
             id = f'file{i:02d}'
             rec = (
                 id,
                 r.title or 'Data',
-                '\n'.join(f'    - {f}' for f in fields)
+                '\n'.join(fields)
             )
             self.resources.append(rec)
 
@@ -81,5 +83,8 @@ class SelectBestResource(FrontendQuery):
                     return resource[0]
         return None
 
+    def semantic_key(self) -> tuple[str, str]:
+        return self.datapoint, self.dataset.storeId()
+
 select_best_resource = FrontendQueryRunner(SelectBestResource)
 
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from typing import Any
+import re
+import time
+
+import numpy as np
+
+from ...common.datatypes import Embedding
+
+# Numbers, dates and month names - texts differing in any of these must never share a result,
+# however similar their embeddings are
+LITERAL_TOKEN = re.compile(
+    r'\d+(?:[.,:/-]\d+)*|\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b',
+    re.IGNORECASE
+)
+
+
+def literal_tokens(text: str) -> str:
+    return ' '.join(token.lower() for token in LITERAL_TOKEN.findall(text or ''))
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join((text or '').lower().split())
+
+
+class SemanticCache:
+
+    # Results of earlier queries, keyed by the embedding of their text and an exact context
+    # (e.g. the candidate dataset ids). A lookup hits when a cached entry in the same context
+    # has a cosine similarity above the threshold and hasn't expired. Entries stored without an
+    # embedding are only matched by their exact context.
+
+    def __init__(self, threshold=0.97, ttl=3600, max_size=1000) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.contexts = dict()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, embedding: Embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def expire(self) -> None:
+        now = time.time()
+        while self.entries:
+            entry_id, (context, _, _, expires) = next(iter(self.entries.items()))
+            if expires > now and len(self.entries) <= self.max_size:
+                break
+            self.remove(entry_id, context)
+
+    def remove(self, entry_id: int, context: str) -> None:
+        del self.entries[entry_id]
+        ids = self.contexts[context]
+        ids.remove(entry_id)
+        if not ids:
+            del self.contexts[context]
+
+    def get(self, embedding: Embedding, context: str) -> tuple[bool, Any]:
+        self.expire()
+        ids = self.contexts.get(context)
+        if ids and embedding is None:
+            self.hits += 1
+            return True, self.entries[ids[-1]][2]
+        ids = [entry_id for entry_id in ids or [] if self.entries[entry_id][1] is not None]
+        if ids:
+            vectors = np.stack([self.entries[entry_id][1] for entry_id in ids])
+            similarities = vectors @ self.normalize(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self.hits += 1
+                return True, self.entries[ids[best]][2]
+        self.misses += 1
+        return False, None
+
+    def set(self, embedding: Embedding, context: str, result: Any) -> None:
+        entry_id = self.next_id
+        self.next_id += 1
+        vector = self.normalize(embedding) if embedding is not None else None
+        self.entries[entry_id] = (context, vector, result, time.time() + self.ttl)
+        self.contexts.setdefault(context, []).append(entry_id)
+        self.expire()
@@ -24,6 +24,12 @@ class SimplifyClaim(FrontendQuery):
     def handle_result(self, result: list[str]) -> Any:
         return result
 
+    def semantic_key(self) -> tuple[str, str]:
+        return self.claim, ''
+
+    def semantic_exact(self) -> bool:
+        return True
+
 
 simplify_claim = FrontendQueryRunner(SimplifyClaim)
 
@@ -3,12 +3,12 @@ from collections import Counter
 import openai
 from openai import OpenAI
 from odds.common.config import config
-from odds.common.vectordb import indexer
+from odds.common.vectordb.dataset_search import find_datasets
 from odds.common.store import store
 from odds.common.embedder import embedder
 from odds.common.catalog_repo import catalog_repo
 from odds.common.cost_collector import CostCollector
-from odds.common.llm.openai.openai_llm_runner import OpenAILLMRunner
+from odds.common.llm.openai.openai_llm_runner import OpenAIProvider
 import sqlite3
 
 import asyncio
@@ -117,10 +117,7 @@ async def search_datasets(query: str):
     query_terms = [term.strip() for term in query_terms]
     query_terms = [term for term in query_terms if term]
     print('QUERY TERMS:', query_terms)
-    embeddings = await asyncio.gather(*[embedder.embed(name) for name in query_terms])
-    dataset_ids = await asyncio.gather(*[indexer.findDatasets(embedding) for embedding in embeddings])
-    dataset_ids = [x for y in dataset_ids for x in y]
-    dataset_ids = [x[0] for x in Counter(dataset_ids).most_common(10)]
+    dataset_ids = [id for id, _ in await find_datasets(query_terms)]
     print('DATASET IDS:', dataset_ids)
     datasets = await asyncio.gather(*[store.getDataset(id) for id in dataset_ids])
     catalogs = [catalog_repo.get_catalog(dataset.catalogId) for dataset in datasets]
@@ -288,7 +285,7 @@ def main():
         content='Please verify the claims in this article:\n\n' + open('article2.txt').read(),
     )
 
-    usage = CostCollector('assistant', OpenAILLMRunner.COSTS)
+    usage = CostCollector('assistant', OpenAIProvider.COSTS)
 
     run = client.beta.threads.runs.create_and_poll(
         thread_id=thread.id,
@@ -6,10 +6,10 @@ from odds.common.store import store
 async def main():
     query = sys.argv[1]
     b = await embedder.embed(query)
-    ids = await indexer.findDatasets(b)
-    datasets = [await store.getDataset(id) for id in ids]
-    for dataset in datasets:
-        print(' - ' + dataset.better_title)
+    results = await indexer.findDatasets(b)
+    for id, score in results:
+        dataset = await store.getDataset(id)
+        print(f' - {score:.3f} {dataset.better_title}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,22 @@
+import json
+
+from odds.common.llm.llm_runner import parse_partial_json
+
+
+def test_partial_json_never_truncates_scalars():
+    # Streamed one character at a time, numbers and literals only appear once complete
+    document = '{"score": 45, "ok": true, "items": [1, 23, -4.5e2], "none": null}'
+    for i in range(1, len(document) + 1):
+        partial = parse_partial_json(document[:i])
+        if partial is None:
+            continue
+        assert partial.get('score', 45) == 45
+        assert partial.get('ok', True) is True
+        assert all(item in (1, 23, -450.0) for item in partial.get('items', []))
+        assert partial.get('none') is None
+    assert parse_partial_json(document) == json.loads(document)
+
+
+def test_partial_json_multi_digit_number():
+    seen = [parse_partial_json('{"value": 12345}'[:i]) for i in range(1, 17)]
+    assert [s for s in seen if s and 'value' in s] == [{'value': 12345}]
@@ -0,0 +1,55 @@
+import sys
+import time
+import asyncio
+
+from odds.common.select import CONFIG
+CONFIG['LLMRunner'] = 'StubLLMRunner'
+# The frontend's semantic cache embeds query texts - keep that local too
+CONFIG['Embedder'] = 'LocalEmbedder'
+
+from odds.common.datatypes import Dataset, Resource, Field
+from odds.backend.processor.meta_describer import MetaDescriber
+from odds.frontend.steps import extract_claims, simplify_claim, extract_datapoints, guess_dataset_names
+
+
+def make_dataset(i):
+    fields = [Field(f'field_{j}', 'string', sample_values=[f'value {k}' for k in range(5)]) for j in range(i % 20)]
+    resources = [Resource(f'https://example.com/{i}/{j}.csv', 'csv', title=f'Resource {j}', fields=fields, row_count=100, status_loaded=True) for j in range(1 + i % 3)]
+    return Dataset('benchmark', f'dataset-{i}', f'Benchmark dataset {i}', description=f'A dataset used for benchmarking, number {i}', resources=resources)
+
+
+async def benchmark_describer(num_datasets):
+    describer = MetaDescriber()
+    datasets = [make_dataset(i) for i in range(num_datasets)]
+    start = time.time()
+    await asyncio.gather(*[describer.describe(dataset, f'benchmark/{dataset.id}') for dataset in datasets])
+    elapsed = time.time() - start
+    described = len([d for d in datasets if d.better_title])
+    print(f'DESCRIBER: {described}/{num_datasets} datasets in {elapsed:.2f}s, {num_datasets / elapsed:.1f} datasets/s')
+
+
+async def verify(text):
+    conversation = ['benchmark']
+    claims = await extract_claims(text, conversation=conversation)
+    for claim in claims:
+        for subclaim in await simplify_claim(claim, conversation=conversation):
+            for datapoint in await extract_datapoints(subclaim, conversation=conversation):
+                await guess_dataset_names(datapoint, conversation=conversation)
+
+
+async def benchmark_frontend(num_texts):
+    start = time.time()
+    await asyncio.gather(*[verify(f'Article number {i}: unemployment went down last year.') for i in range(num_texts)])
+    elapsed = time.time() - start
+    print(f'FRONTEND: {num_texts} texts in {elapsed:.2f}s, {num_texts / elapsed:.1f} texts/s')
+
+
+async def main(num_datasets, num_texts):
+    await benchmark_describer(num_datasets)
+    await benchmark_frontend(num_texts)
+
+
+if __name__ == '__main__':
+    num_datasets = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    num_texts = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(num_datasets, num_texts))
@@ -0,0 +1,5 @@
+import sys
+from odds.backend import backend
+b = backend.ODDSBackend()
+b.reindex_all(catalogId=sys.argv[1] if len(sys.argv) > 1 else None)
+del b